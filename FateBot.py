@@ -1,31 +1,249 @@
+import asyncio
+import contextlib
+import logging
+import time
+
 import aiosqlite
 import discord
 from discord.ext import commands
 
-import config
+log = logging.getLogger(__name__)
+
+# PRAGMAs applied to the DB connection
+DB_PROFILE = {
+    'auto_vacuum': 'incremental',  # only applies to new DBs
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'mmap_size': 256 * 1024 ** 2,  # bytes
+    'cache_size': -16 * 1024,  # negative: in KiB
+    'temp_store': 'memory',
+    'foreign_keys': 'on',
+}
 
 
-async def create_db_connection(db_name):
-    """Create the connection to the SQLite database."""
+async def create_db_connection(db_name, profile=DB_PROFILE):
+    """Create the connection to the SQLite database, and apply the
+    PRAGMAs of the profile.
+    """
+
+    db = await aiosqlite.connect(
+        db_name,
+        detect_types=1,  # 1: parse declared types
+    )
 
-    return await aiosqlite.connect(
-        db_name, detect_types=1)  # 1: parse declared types
+    for pragma, value in profile.items():
+        # PRAGMA does not accept parameters
+        await db.execute(f"PRAGMA {pragma} = {value}")
 
+    return db
 
-class FateBot(commands.Bot):
-    """The Bot for the Fate Bound Discord server."""
+
+class FateBot(commands.AutoShardedBot):
+    """The Bot for the Fate Bound Discord server.
+    It runs the number of shards recommended by Discord for the guilds
+    it is in, unless shard_count is given. With shard_ids, it only runs
+    those shards, the others being run by other processes.
+    """
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
-        # Create the DB connection and allow for name-based
-        # access of data columns
-        self.db = self.loop.run_until_complete(
-            create_db_connection(kwargs.get('db_name', ':memory:')))
+        # The DB connection is created in the first phase of start
+        self.db = None
+        self.db_name = kwargs.get('db_name', ':memory:')
+        self.db_profile = kwargs.get('db_profile', DB_PROFILE)
+        self.startup_extensions = kwargs.get('startup_extensions', [])
+
+        # Duration in seconds of each phase of the startup
+        self.startup_phases = {}
+        self._startup_tasks = []
+        self._shutdown_tasks = []
+        self._fully_ready = asyncio.Event()
+
+        # Delay in seconds during which concurrent commits are merged
+        # into a single one, disabled if None
+        self.group_commit = kwargs.get('group_commit')
+        self._commit_waiter = None
+
+        # Held by each change of the DB, as all of them share the same
+        # connection and then the same transaction
+        self.db_lock = asyncio.Lock()
+
+        # Port of the local metrics endpoint, disabled if None
+        self.metrics_port = kwargs.get('metrics_port')
+
+    async def commit(self):
+        """Commit the pending changes to the DB.
+        With group commit enabled, the commits requested during the
+        same window share a single commit of the DB.
+        """
+
+        if not self.group_commit:
+            async with self.db_lock:
+                await self.db.commit()
+            return
+
+        if self._commit_waiter is None:
+            self._commit_waiter = self.loop.create_future()
+            self.loop.create_task(self._group_commit())
+
+        await asyncio.shield(self._commit_waiter)
+
+    async def _group_commit(self):
+        """Commit the DB once for all the waiting commits."""
+
+        await asyncio.sleep(self.group_commit)
+        waiter, self._commit_waiter = self._commit_waiter, None
+        try:
+            async with self.db_lock:
+                await self.db.commit()
+        except Exception as e:
+            waiter.set_exception(e)
+        else:
+            waiter.set_result(None)
+
+    @contextlib.asynccontextmanager
+    async def transaction(self):
+        """Run the statements of the block as a single change of the DB,
+        then commit it.
+
+        The block holds the lock of the connection, so that no commit
+        happens in the middle of it. If it raises, only its own
+        statements are rolled back, to a savepoint, and those of the
+        other changes waiting for the group commit are kept.
+        """
+
+        async with self.db_lock:
+            began = not self.db.in_transaction
+            if began:
+                # releasing the outermost savepoint would commit
+                await self.db.execute("BEGIN")
+            await self.db.execute("SAVEPOINT change")
+            try:
+                yield self.db
+            except BaseException:
+                if began:
+                    # no other change is pending, end the transaction
+                    # so that the write lock of the DB is released
+                    await self.db.rollback()
+                else:
+                    await self.db.execute("ROLLBACK TO change")
+                    await self.db.execute("RELEASE change")
+                raise
+            await self.db.execute("RELEASE change")
+
+        await self.commit()
+
+    @property
+    def fully_ready(self):
+        """True once connected and all the startup tasks are done,
+        e.g. once all the menus are restored.
+        """
+
+        return self._fully_ready.is_set()
+
+    async def wait_until_fully_ready(self):
+        """Wait until the Bot is fully ready."""
+
+        await self._fully_ready.wait()
+
+    async def start(self, token, *, reconnect=True):
+        """Start the Bot through the phases of the startup.
+
+        The DB and the login are independent and run concurrently. The
+        extensions are loaded once the DB is open, and their startup
+        tasks run alongside the connection to the gateway.
+        """
+
+        started = time.perf_counter()
+        await asyncio.gather(
+            self._setup(),
+            self.run_phase("login", self.login(token)),
+        )
+
+        self.loop.create_task(self._wait_fully_ready(started))
+        await self.connect(reconnect=reconnect)
+
+    async def _setup(self):
+        await self.run_phase("db", self._open_db())
+        await self.run_phase("extensions", self._load_extensions())
+
+    async def _open_db(self):
+        # allow for name-based access of data columns
+        self.db = await create_db_connection(self.db_name, self.db_profile)
         self.db.row_factory = aiosqlite.Row
 
+    async def _load_extensions(self):
+        for extension in self.startup_extensions:
+            self.load_extension(extension)
+
+    async def run_phase(self, name, aw):
+        """Await a phase of the startup, and record its duration."""
+
+        start = time.perf_counter()
+        result = await aw
+        duration = time.perf_counter() - start
+        self.startup_phases[name] = duration
+        log.info("Startup phase %s done in %.3f s.", name, duration)
+
+        return result
+
+    def add_startup_task(self, coro):
+        """Run the coroutine during the startup. The Bot is only fully
+        ready once it is done.
+        """
+
+        task = self.loop.create_task(coro)
+        self._startup_tasks.append(task)
+        return task
+
+    def add_shutdown_task(self, coro):
+        """Run the coroutine, e.g. when an extension is unloaded. The
+        Bot waits for it on close, before closing the DB.
+        """
+
+        self._shutdown_tasks = [
+            t for t in self._shutdown_tasks if not t.done()]
+        task = self.loop.create_task(coro)
+        self._shutdown_tasks.append(task)
+        return task
+
+    async def _wait_fully_ready(self, started):
+        await self.run_phase("gateway", self.wait_until_ready())
+
+        results = await asyncio.gather(
+            *self._startup_tasks, return_exceptions=True)
+        errors = [r for r in results if isinstance(r, Exception)]
+        for error in errors:
+            log.error("Startup task failed.", exc_info=error)
+
+        if errors:
+            log.error("The Bot is running, but is not fully ready.")
+            return
+
+        self.startup_phases["total"] = time.perf_counter() - started
+        self._fully_ready.set()
+        log.info(
+            "Fully ready in %.3f s.", self.startup_phases["total"])
+
     async def close(self):
-        """Subclass the method to close underlying processes."""
-        await self.db.close()
+        """Subclass the method to close underlying processes.
+        The extensions are unloaded first, so that they can write their
+        last changes before the DB is closed.
+        """
+        for extension in tuple(self.extensions):
+            try:
+                self.unload_extension(extension)
+            except Exception:
+                log.exception("Could not unload %s.", extension)
+
+        results = await asyncio.gather(
+            *self._shutdown_tasks, return_exceptions=True)
+        for error in results:
+            if isinstance(error, Exception):
+                log.error("Shutdown task failed.", exc_info=error)
+
+        if self.db is not None:
+            await self.db.close()
         await super().close()
 
     async def on_ready(self):
@@ -42,19 +260,34 @@ class FateBot(commands.Bot):
 
 
 if __name__ == '__main__':
+    import os
+
+    import config
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+    )
+
+    # Several processes can share the DB, each running some of the
+    # shards, e.g. FATEBOT_SHARD_IDS=0,1 and FATEBOT_SHARD_COUNT=4
+    shard_ids = os.environ.get('FATEBOT_SHARD_IDS')
+    shard_count = os.environ.get('FATEBOT_SHARD_COUNT')
+
     intents = discord.Intents.all()
     bot = FateBot(
         description="Bot for the Fate Bound ESO Guild.",
         command_prefix="&",
         intents=intents,
+        shard_ids=(
+            [int(i) for i in shard_ids.split(',')] if shard_ids else None),
+        shard_count=int(shard_count) if shard_count else None,
         db_name='db/FateBot.db',
+        group_commit=0.005,
+        metrics_port=9100,
+        startup_extensions=[
+            'cogs.EventESO',
+        ],
     )
 
-    startup_extensions = [
-        'cogs.EventESO',
-    ]
-
-    for extension in startup_extensions:
-        bot.load_extension(extension)
-
     bot.run(config.token)
@@ -0,0 +1,87 @@
+"""Benchmark of the participant commits, with and without the SQLite
+tuning profile of the bot.
+
+Run from the root of the repository:
+
+    python -m benchmarks.db_commits [commits]
+"""
+
+import asyncio
+from datetime import datetime
+import os
+import sys
+import tempfile
+import time
+
+import aiosqlite
+
+from FateBot import DB_PROFILE, create_db_connection
+from cogs.EventESO import migrations
+
+# None: the connection as created by aiosqlite, without the bot's setup
+PROFILES = {
+    'default': None,
+    'tuned': DB_PROFILE,
+}
+
+
+async def run(profile, commits):
+    """Return the number of participant commits per second."""
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_name = os.path.join(tmp, 'bench.db')
+        if profile is None:
+            db = await aiosqlite.connect(db_name, detect_types=1)
+        else:
+            db = await create_db_connection(db_name, profile)
+        await migrations.migrate(db)
+
+        async with db.execute(
+                """
+                INSERT INTO eventeso_event (event_name,
+                                            event_type,
+                                            is_done,
+                                            trigger_at)
+                VALUES ('vAS', 'trial', 0, :trigger_at)
+                """,
+                {'trigger_at': datetime.utcnow()}
+        ) as c:
+            event_id = c.lastrowid
+        await db.commit()
+
+        start = time.perf_counter()
+        for i in range(commits):
+            params = {'event_id': event_id, 'role': 'dps0', 'user_id': i % 12}
+            await db.execute(
+                """
+                DELETE FROM eventeso_participant
+                 WHERE user_id = :user_id
+                   AND event_id = :event_id
+                """,
+                params
+            )
+            await db.execute(
+                """
+                INSERT OR IGNORE INTO eventeso_participant
+                VALUES (:event_id,
+                        :role,
+                        :user_id)
+                """,
+                params
+            )
+            await db.commit()
+        elapsed = time.perf_counter() - start
+
+        await db.close()
+
+    return commits / elapsed
+
+
+async def main(commits):
+    for name, profile in PROFILES.items():
+        rate = await run(profile, commits)
+        print(f"{name:>8}: {rate:8.0f} commits/s")
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000))
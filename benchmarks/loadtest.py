@@ -0,0 +1,518 @@
+"""Offline load test of the EventESO cog, against a fake of Discord
+with rate limits, and a real SQLite file.
+
+Scenarios:
+
+    storm    members reacting at once to many open events
+    restart  start of the bot with many pending events in the DB
+    trigger  many events reaching their trigger time together
+
+Run from the root of the repository:
+
+    python -m benchmarks.loadtest [scenario ...]
+
+The random choices and REST latencies are seeded, so that the numbers
+of two runs can be compared.
+"""
+
+from collections import Counter
+from datetime import datetime, timedelta
+import asyncio
+import itertools
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+import discord
+
+from FateBot import FateBot
+from cogs.EventESO import menus
+
+SEED = 1234
+
+GUILD_ID = 1
+BOT_ID = 2
+
+# Size of the scenarios
+STORM_EVENTS = 30
+STORM_MEMBERS = 200
+STORM_REACTIONS_PER_MEMBER = 3
+RESTART_EVENTS = 300
+RESTART_PARTICIPANTS = 8
+TRIGGER_EVENTS = 100
+EVENTS_PER_CHANNEL = 10
+
+# Time in seconds of a REST call, without the rate limits
+REST_LATENCY = (0.02, 0.08)
+
+# Rate limits of the routes by channel, and of the whole bot, as a
+# number of requests per window in seconds
+RATE_LIMITS = {
+    'send': (5, 5.0),
+    'edit': (5, 5.0),
+    'delete': (5, 5.0),
+    'add_reaction': (1, 0.25),
+    'clear_reactions': (1, 0.25),
+}
+GLOBAL_RATE_LIMIT = (50, 1.0)
+
+
+class Bucket:
+    """Rate limit bucket, refilled at the end of each window."""
+
+    def __init__(self, limit, per):
+        self.limit = limit
+        self.per = per
+        self.remaining = limit
+        self.reset_at = 0.0
+
+    def acquire(self, now):
+        """Take a request from the bucket.
+        Return 0, or the time to wait before retrying.
+        """
+
+        if now >= self.reset_at:
+            self.remaining = self.limit
+            self.reset_at = now + self.per
+
+        if self.remaining:
+            self.remaining -= 1
+            return 0.0
+
+        return self.reset_at - now
+
+
+class FakeDiscord:
+    """Fake of the Discord API for a single guild, with the latency
+    and the rate limits of the REST calls.
+    """
+
+    def __init__(self, rng):
+        self.rng = rng
+        self.user = SimpleNamespace(
+            id=BOT_ID,
+            name="FateBot",
+            avatar_url="https://cdn.discordapp.com/embed/avatars/0.png",
+        )
+        self.guild = SimpleNamespace(
+            id=GUILD_ID, me=SimpleNamespace(id=BOT_ID))
+        self.channels = {}
+        self._ids = itertools.count(1000)
+        self.reset()
+
+    def reset(self):
+        """Reset the counters and the rate limits."""
+
+        self.calls = Counter()
+        self.rate_limited = 0
+        self._buckets = {}
+        self._global = Bucket(*GLOBAL_RATE_LIMIT)
+
+    def next_id(self):
+        return next(self._ids)
+
+    def create_channels(self, count):
+        channels = [FakeChannel(self, self.next_id()) for _ in range(count)]
+        self.channels.update((channel.id, channel) for channel in channels)
+        return channels
+
+    async def request(self, route, channel_id):
+        """Wait for a REST call, retrying after the 429 responses like
+        discord.py does.
+        """
+
+        self.calls[route] += 1
+        loop = asyncio.get_event_loop()
+        while True:
+            retry_after = 0.0
+            if route in RATE_LIMITS:
+                bucket = self._buckets.get((route, channel_id))
+                if bucket is None:
+                    bucket = self._buckets[(route, channel_id)] = Bucket(
+                        *RATE_LIMITS[route])
+                retry_after = bucket.acquire(loop.time())
+
+            if not retry_after:
+                retry_after = self._global.acquire(loop.time())
+
+            if not retry_after:
+                break
+
+            self.rate_limited += 1
+            await asyncio.sleep(retry_after)
+
+        await asyncio.sleep(self.rng.uniform(*REST_LATENCY))
+
+
+class FakeChannel:
+    def __init__(self, api, id):
+        self.api = api
+        self.id = id
+        self.guild = api.guild
+        self.messages = {}
+        self.sent = []  # (time, content) of the messages sent
+
+    def permissions_for(self, member):
+        return discord.Permissions.all()
+
+    def add_message(self, reactions=()):
+        """Add a message directly, like one sent before a restart."""
+
+        message = FakeMessage(self, self.api.next_id())
+        message.reactions = [
+            SimpleNamespace(emoji=emoji, me=True) for emoji in reactions]
+        self.messages[message.id] = message
+        return message
+
+    async def send(self, content=None, *, embed=None, allowed_mentions=None):
+        await self.api.request('send', self.id)
+        message = self.add_message()
+        message.content = content
+        message.embed = embed
+        self.sent.append((datetime.utcnow(), content))
+        return message
+
+    async def fetch_message(self, id):
+        await self.api.request('fetch_message', self.id)
+        try:
+            return self.messages[id]
+        except KeyError:
+            response = SimpleNamespace(status=404, reason="Not Found")
+            raise discord.NotFound(response, "Unknown Message")
+
+
+class FakeMessage:
+    def __init__(self, channel, id):
+        self.channel = channel
+        self.guild = channel.guild
+        self.id = id
+        self.created_at = datetime.utcnow()
+        self.content = None
+        self.embed = None
+        self.reactions = []
+
+    async def edit(self, *, content=None, embed=None):
+        await self.channel.api.request('edit', self.channel.id)
+        self.content = content
+        self.embed = embed
+
+    async def add_reaction(self, emoji):
+        await self.channel.api.request('add_reaction', self.channel.id)
+        self.reactions.append(SimpleNamespace(emoji=emoji, me=True))
+
+    async def clear_reactions(self):
+        await self.channel.api.request('clear_reactions', self.channel.id)
+        self.reactions = []
+
+    async def delete(self):
+        await self.channel.api.request('delete', self.channel.id)
+        del self.channel.messages[self.id]
+
+
+class LoadTestBot(FateBot):
+    """FateBot using the fake of Discord instead of the gateway."""
+
+    def __init__(self, api, db_name):
+        super().__init__(
+            command_prefix="&",
+            intents=discord.Intents.none(),
+            db_name=db_name,
+            group_commit=0.005,
+            startup_extensions=['cogs.EventESO'],
+        )
+        self.api = api
+        self._connection.user = api.user
+
+    def get_channel(self, id):
+        return self.api.channels.get(id)
+
+    async def fetch_channel(self, id):
+        await self.api.request('fetch_channel', id)
+        return self.api.channels[id]
+
+    async def start_offline(self):
+        """Go through the startup, with the gateway ready at once."""
+
+        started = time.perf_counter()
+        await self._setup()
+        self.loop.create_task(self._wait_fully_ready(started))
+        self._ready.set()
+        await self.wait_until_fully_ready()
+
+    async def shutdown(self):
+        """Stop the cog, which flushes the pending changes, and the bot."""
+
+        self.unload_extension('cogs.EventESO')
+        await self.close()
+
+
+def emoji(button):
+    """Return the PartialEmoji of a button, as in a reaction payload."""
+
+    if button.startswith("<:"):
+        name, id = button[2:-1].split(":")
+        return discord.PartialEmoji(name=name, id=int(id))
+
+    return discord.PartialEmoji(name=button)
+
+
+def reaction(menu, user_id, button):
+    return SimpleNamespace(
+        message_id=menu.message.id,
+        channel_id=menu.message.channel.id,
+        guild_id=GUILD_ID,
+        user_id=user_id,
+        emoji=emoji(button),
+        event_type="REACTION_ADD",
+    )
+
+
+def random_events(rng, count, trigger_at):
+    """Return (event_type, event_name, trigger_at) of random events."""
+
+    templates = [
+        (event_type, event_name)
+        for event_type in ("arena", "dungeon", "trial")
+        for event_name in menus.TEMPLATES.templates(event_type)
+    ]
+    return [(*rng.choice(templates), trigger_at) for _ in range(count)]
+
+
+async def seed_events(bot, rng, count, trigger_at):
+    """Create events as left by a previous run: in the DB with some
+    participants, and their message with all its reactions.
+    """
+
+    cog = bot.get_cog("EventESO")
+    event_ids = await cog._create_events(
+        GUILD_ID, random_events(rng, count, trigger_at))
+    channels = bot.api.create_channels(
+        math.ceil(count / EVENTS_PER_CHANNEL))
+
+    messages = []
+    participants = []
+    for i, event_id in enumerate(event_ids):
+        event = await cog._get_event_data(event_id)
+        template = menus.TEMPLATES.get(event['event_type'], event['event_name'])
+        message = channels[i % len(channels)].add_message(
+            [menus.BUTTONS[role] for role in template.roles]
+            + [menus.BUTTONS[role] for role in ("leader", "fill", "clear")])
+        messages.append({
+            'event_id': event_id,
+            'channel_id': message.channel.id,
+            'message_id': message.id,
+        })
+        for user_id in rng.sample(range(10000), RESTART_PARTICIPANTS):
+            participants.append({
+                'event_id': event_id,
+                'role': rng.choice(template.roles),
+                'user_id': user_id,
+            })
+
+    await bot.db.executemany(
+        """
+        UPDATE eventeso_event
+           SET channel_id = :channel_id,
+               message_id = :message_id
+         WHERE event_id = :event_id
+        """,
+        messages
+    )
+    await bot.db.executemany(
+        """
+        INSERT OR IGNORE INTO eventeso_participant (event_id, role, user_id)
+        VALUES (:event_id, :role, :user_id)
+        """,
+        participants
+    )
+    await bot.db.commit()
+
+
+def percentile(values, q):
+    """Return the nearest-rank percentile of the values."""
+
+    values = sorted(values)
+    return values[max(0, math.ceil(q * len(values)) - 1)]
+
+
+def report(name, latencies, elapsed, api):
+    print(
+        f"{name:<18} {len(latencies):>6} {elapsed:>8.2f}s "
+        f"{len(latencies) / elapsed:>8.1f}/s "
+        f"{percentile(latencies, 0.5) * 1000:>8.1f}ms "
+        f"{percentile(latencies, 0.99) * 1000:>8.1f}ms "
+        f"{sum(api.calls.values()):>6} {api.rate_limited:>6}"
+    )
+
+
+async def storm(db_name, rng):
+    """Members reacting at once to the open events."""
+
+    api = FakeDiscord(rng)
+    bot = LoadTestBot(api, db_name)
+    await bot.start_offline()
+    cog = bot.get_cog("EventESO")
+
+    trigger_at = datetime.utcnow() + timedelta(days=2)
+    event_ids = await cog._create_events(
+        GUILD_ID, random_events(rng, STORM_EVENTS, trigger_at))
+    channels = api.create_channels(STORM_EVENTS)
+    await asyncio.gather(*[
+        cog._start_event(channel, event_id)
+        for channel, event_id in zip(channels, event_ids)
+    ])
+
+    embed_delays = []
+    running = list(cog.running_events.values())
+    for menu in running:
+        menu.updater.observe = embed_delays.append
+
+    reactions = []
+    for user_id in range(STORM_MEMBERS):
+        for menu in rng.sample(running, STORM_REACTIONS_PER_MEMBER):
+            role = rng.choice(menu.template.roles + ("fill",))
+            reactions.append(reaction(menu, user_id, menus.BUTTONS[role]))
+
+    latencies = []
+
+    async def react(payload):
+        start = time.perf_counter()
+        await cog.on_menu_reaction(payload)
+        latencies.append(time.perf_counter() - start)
+
+    api.reset()
+    start = time.perf_counter()
+    await asyncio.gather(*[react(payload) for payload in reactions])
+    elapsed = time.perf_counter() - start
+    report("storm reactions", latencies, elapsed, api)
+
+    await asyncio.gather(*[menu.updater.flush() for menu in running])
+    report("storm embed edits", embed_delays,
+           time.perf_counter() - start, api)
+
+    await bot.shutdown()
+
+
+async def restart(db_name, rng):
+    """Start of the bot with many pending events, then a first reaction
+    on each of the dormant ones.
+    """
+
+    api = FakeDiscord(rng)
+    bot = LoadTestBot(api, db_name)
+    await bot.start_offline()
+    # half of the events close to their trigger, half dormant
+    now = datetime.utcnow()
+    await seed_events(bot, rng, RESTART_EVENTS // 2,
+                      now + timedelta(hours=12))
+    await seed_events(bot, rng, RESTART_EVENTS - RESTART_EVENTS // 2,
+                      now + timedelta(days=3))
+    await bot.shutdown()
+
+    api.reset()
+    bot = LoadTestBot(api, db_name)
+    await bot.start_offline()
+    cog = bot.get_cog("EventESO")
+    phases = ", ".join(
+        f"{phase} {duration * 1000:.0f}ms"
+        for phase, duration in bot.startup_phases.items())
+    print(f"{'restart':<18} {len(cog.running_events):>6} running, "
+          f"{sum(len(g.dormant_events) for g in cog.guilds.values())} "
+          "dormant, "
+          f"{sum(api.calls.values())} REST calls, "
+          f"{api.rate_limited} rate limited ({phases})")
+
+    dormant = [
+        event for guild in cog.guilds.values()
+        for event in guild.dormant_events.values()
+    ]
+    latencies = []
+
+    async def react(event, user_id):
+        payload = SimpleNamespace(
+            message_id=event['message_id'],
+            channel_id=event['channel_id'],
+            guild_id=GUILD_ID,
+            user_id=user_id,
+            emoji=emoji(menus.BUTTONS["fill"]),
+            event_type="REACTION_ADD",
+        )
+        start = time.perf_counter()
+        await cog.on_menu_reaction(payload)
+        latencies.append(time.perf_counter() - start)
+
+    api.reset()
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        react(event, 20000 + i) for i, event in enumerate(dormant)])
+    report("dormant activation", latencies,
+           time.perf_counter() - start, api)
+
+    await bot.shutdown()
+
+
+async def trigger(db_name, rng):
+    """Many events reaching their trigger time together."""
+
+    api = FakeDiscord(rng)
+    bot = LoadTestBot(api, db_name)
+    await bot.start_offline()
+    await seed_events(bot, rng, TRIGGER_EVENTS,
+                      datetime.utcnow() + timedelta(hours=1))
+    await bot.shutdown()
+
+    bot = LoadTestBot(api, db_name)
+    await bot.start_offline()
+    cog = bot.get_cog("EventESO")
+
+    # move all the trigger times to the same instant
+    trigger_at = datetime.utcnow() + timedelta(seconds=1)
+    for event_id, menu in cog.running_events.items():
+        menu.trigger_at = trigger_at
+        cog.scheduler.schedule(event_id, trigger_at)
+
+    def announcements():
+        return [
+            sent_at for channel in api.channels.values()
+            for sent_at, content in channel.sent
+            if content.startswith("Hey")
+        ]
+
+    count = len(cog.running_events)
+    api.reset()
+    start = time.perf_counter()
+    while len(announcements()) < count:
+        await asyncio.sleep(0.1)
+    elapsed = time.perf_counter() - start
+
+    latencies = [
+        (sent_at - trigger_at).total_seconds()
+        for sent_at in announcements()
+    ]
+    report("trigger lateness", latencies, elapsed, api)
+
+    await bot.shutdown()
+
+
+SCENARIOS = {
+    'storm': storm,
+    'restart': restart,
+    'trigger': trigger,
+}
+
+
+async def main(names):
+    print(f"{'scenario':<18} {'count':>6} {'time':>9} {'rate':>10} "
+          f"{'p50':>10} {'p99':>10} {'REST':>6} {'429':>6}")
+    for name in names:
+        rng = random.Random(SEED)
+        with tempfile.TemporaryDirectory() as tmp:
+            await SCENARIOS[name](os.path.join(tmp, 'loadtest.db'), rng)
+
+
+if __name__ == '__main__':
+    asyncio.run(main(sys.argv[1:] or list(SCENARIOS)))
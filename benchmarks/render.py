@@ -0,0 +1,80 @@
+"""Micro-benchmark of the embed render done on every click, for all
+the event templates, with and without the cached embed skeleton.
+
+Run from the root of the repository:
+
+    python -m benchmarks.render [renders]
+"""
+
+from datetime import datetime
+import sys
+import time
+from types import SimpleNamespace
+
+from cogs.EventESO import menus
+from cogs.EventESO.registry import TEMPLATE_FILES
+
+BOT = SimpleNamespace(
+    user=SimpleNamespace(
+        name="FateBot",
+        avatar_url="https://cdn.discordapp.com/embed/avatars/0.png",
+    ),
+)
+
+
+def make_menu(event_type, event_name):
+    """Return a menu with every role of the event filled."""
+
+    menu = menus.RegistrationMenu(
+        event_data={
+            'event_id': 1,
+            'event_name': event_name,
+            'event_type': event_type,
+            'trigger_at': datetime.utcnow(),
+        },
+        writer=None,
+    )
+    menu.bot = BOT
+
+    user_id = 0
+    for role in menu.template.roles:
+        for _ in range(menu.template.amounts[role]):
+            user_id += 1
+            menu.roster.add(user_id, role)
+    menu.roster.add(1, 'leader')
+    menu.roster.add(user_id + 1, 'fill')
+
+    return menu
+
+
+def render(menu, renders, cached):
+    """Return the mean time of a render, in microseconds."""
+
+    start = time.perf_counter()
+    for _ in range(renders):
+        if not cached:
+            menu._skeleton = None
+        menu.build_embed()
+
+    return (time.perf_counter() - start) / renders * 1e6
+
+
+def main(renders):
+    print(f"{'event':<20} {'rebuilt':>10} {'cached':>10}")
+    for event_type in TEMPLATE_FILES:
+        results = {True: [], False: []}
+        for event_name in menus.TEMPLATES.templates(event_type):
+            menu = make_menu(event_type, event_name)
+            for cached in results:
+                results[cached].append(render(menu, renders, cached))
+
+        count = len(results[True])
+        print(
+            f"{event_type + f' ({count})':<20} "
+            f"{sum(results[False]) / count:8.1f}us "
+            f"{sum(results[True]) / count:8.1f}us"
+        )
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
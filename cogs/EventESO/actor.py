@@ -0,0 +1,98 @@
+import asyncio
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class EventActor:
+    """Ordered work queue of a registration menu.
+
+    The work submitted to the actor is applied one item at a time, in
+    order of arrival, so that concurrent reactions on the same event
+    cannot interleave. Each event has its own actor, so different
+    events are still processed in parallel.
+    """
+
+    def __init__(self):
+        self._queue = asyncio.Queue()
+        self._task = None
+
+        self.processed = 0
+        self.dropped = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    @property
+    def depth(self):
+        """Number of items waiting to be processed."""
+
+        return self._queue.qsize()
+
+    @property
+    def latency_mean(self):
+        """Mean time in seconds between submitting an item and the end
+        of its processing.
+        """
+
+        if not self.processed:
+            return 0.0
+
+        return self.latency_total / self.processed
+
+    def start(self):
+        """Start processing the queue."""
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_event_loop().create_task(self._run())
+
+    def stop(self):
+        """Stop processing the queue. The waiting items are dropped."""
+
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+        while not self._queue.empty():
+            *_, future, _ = self._queue.get_nowait()
+            future.cancel()
+            self.dropped += 1
+
+    def submit(self, func, *args):
+        """Queue a call to the coroutine function func.
+        Return a future set once the call is done.
+        """
+
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self._queue.put_nowait((func, args, future, loop.time()))
+        return future
+
+    async def join(self):
+        """Wait until the items submitted so far are processed."""
+
+        async def noop():
+            pass
+
+        await self.submit(noop)
+
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            func, args, future, submitted_at = await self._queue.get()
+            if future.cancelled():
+                self.dropped += 1
+                continue
+
+            try:
+                result = await func(*args)
+            except Exception:
+                log.exception("Error while processing %r.", func)
+                result = None
+
+            latency = loop.time() - submitted_at
+            self.processed += 1
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+
+            if not future.done():
+                future.set_result(result)
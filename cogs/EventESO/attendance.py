@@ -0,0 +1,124 @@
+import logging
+
+log = logging.getLogger(__name__)
+
+# Each statement adds a triggered event to one of the aggregate tables,
+# from its participants at the time of the trigger
+RECORD_EVENT = (
+    # per user
+    """
+    INSERT INTO eventeso_stats_user (guild_id,
+                                     user_id,
+                                     events,
+                                     led,
+                                     filled,
+                                     last_at)
+    SELECT e.guild_id,
+           p.user_id,
+           1,
+           MAX(p.role = 'leader'),
+           MAX(p.role = 'fill'),
+           e.trigger_at
+      FROM eventeso_participant_history AS p
+      JOIN eventeso_event_history AS e
+        ON e.event_id = p.event_id
+     WHERE p.event_id = :event_id
+       AND e.guild_id IS NOT NULL
+     GROUP BY p.user_id
+        ON CONFLICT (guild_id, user_id) DO UPDATE
+       SET events = events + 1,
+           led = led + excluded.led,
+           filled = filled + excluded.filled,
+           last_at = MAX(last_at, excluded.last_at)
+    """,
+    # per user and role
+    """
+    INSERT INTO eventeso_stats_role (guild_id, user_id, role, count)
+    SELECT e.guild_id, p.user_id, p.role, 1
+      FROM eventeso_participant_history AS p
+      JOIN eventeso_event_history AS e
+        ON e.event_id = p.event_id
+     WHERE p.event_id = :event_id
+       AND e.guild_id IS NOT NULL
+        ON CONFLICT (guild_id, user_id, role) DO UPDATE
+       SET count = count + 1
+    """,
+    # per event type and name
+    """
+    INSERT INTO eventeso_stats_event (guild_id,
+                                      event_type,
+                                      event_name,
+                                      events,
+                                      participants)
+    SELECT e.guild_id,
+           e.event_type,
+           e.event_name,
+           1,
+           (SELECT COUNT(DISTINCT user_id)
+              FROM eventeso_participant_history
+             WHERE event_id = e.event_id)
+      FROM eventeso_event_history AS e
+     WHERE e.event_id = :event_id
+       AND e.guild_id IS NOT NULL
+        ON CONFLICT (guild_id, event_type, event_name) DO UPDATE
+       SET events = events + 1,
+           participants = participants + excluded.participants
+    """,
+    # per week, starting on Monday
+    """
+    INSERT INTO eventeso_stats_week (guild_id, week, events, participants)
+    SELECT e.guild_id,
+           date(e.trigger_at, 'weekday 0', '-6 days'),
+           1,
+           (SELECT COUNT(DISTINCT user_id)
+              FROM eventeso_participant_history
+             WHERE event_id = e.event_id)
+      FROM eventeso_event_history AS e
+     WHERE e.event_id = :event_id
+       AND e.guild_id IS NOT NULL
+        ON CONFLICT (guild_id, week) DO UPDATE
+       SET events = events + 1,
+           participants = participants + excluded.participants
+    """,
+)
+
+AGGREGATE_TABLES = (
+    "eventeso_stats_user",
+    "eventeso_stats_role",
+    "eventeso_stats_event",
+    "eventeso_stats_week",
+)
+
+
+async def record_event(db, event_id):
+    """Add the triggered event to the aggregates, without committing.
+    It must only be recorded once, when it is marked as done.
+    """
+
+    for query in RECORD_EVENT:
+        await db.execute(query, {'event_id': event_id})
+
+
+async def rebuild(db):
+    """Compute the aggregates again from all the finished events,
+    without committing. This scans the whole history.
+    """
+
+    for table in AGGREGATE_TABLES:
+        await db.execute(f"DELETE FROM {table}")
+
+    async with db.execute(
+            """
+            SELECT event_id
+              FROM eventeso_event_history
+             WHERE is_done = 1
+             ORDER BY event_id
+            """
+    ) as c:
+        event_ids = [row[0] for row in await c.fetchall()]
+
+    for event_id in event_ids:
+        await record_event(db, event_id)
+
+    log.info("Rebuilt the attendance statistics of %d events.",
+             len(event_ids))
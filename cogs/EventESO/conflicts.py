@@ -0,0 +1,130 @@
+import bisect
+from datetime import timedelta
+
+
+class EventInterval:
+    """Time interval of an event, and its participants in a role."""
+
+    __slots__ = ("event_id", "guild_id", "start", "end", "label", "users")
+
+    def __init__(self, event_id, guild_id, start, end, label):
+        self.event_id = event_id
+        self.guild_id = guild_id
+        self.start = start
+        self.end = end
+        self.label = label
+        self.users = set()
+
+    def __repr__(self):
+        return f"<EventInterval {self.event_id} {self.start}-{self.end}>"
+
+
+class ConflictIndex:
+    """Index of the time intervals of the active events, by member.
+
+    Each member has the start times of their events in a sorted list.
+    An event overlapping an interval must start before its end, and
+    after its start minus the longest duration, so the overlaps are
+    found with a binary search rather than a scan of the events.
+    Only the members in a role are indexed, not the Leader on its own
+    or the Fill list.
+    """
+
+    def __init__(self):
+        self._events = {}  # event_id: EventInterval
+        self._starts = {}  # (guild_id, user_id): sorted [(start, event_id)]
+        self._longest = timedelta(0)
+
+    def __contains__(self, event_id):
+        return event_id in self._events
+
+    def __len__(self):
+        return len(self._events)
+
+    def set_event(self, event_id, guild_id, start, duration, label):
+        """Add the event, or move it and its participants to its new
+        interval.
+        """
+
+        users = ()
+        previous = self._events.get(event_id)
+        if previous is not None:
+            users = list(previous.users)
+            for user_id in users:
+                self._unlink(previous, user_id)
+
+        event = self._events[event_id] = EventInterval(
+            event_id, guild_id, start, start + duration, label)
+        for user_id in users:
+            self._link(event, user_id)
+
+        self._longest = max(self._longest, duration)
+
+    def remove_event(self, event_id):
+        """Remove the event and its participants, if indexed."""
+
+        event = self._events.pop(event_id, None)
+        if event is None:
+            return
+
+        for user_id in list(event.users):
+            self._unlink(event, user_id)
+
+    def set_participant(self, event_id, user_id, present):
+        """Add the user to the event, or remove them."""
+
+        event = self._events.get(event_id)
+        if event is None:
+            return
+
+        if present and user_id not in event.users:
+            self._link(event, user_id)
+        elif not present and user_id in event.users:
+            self._unlink(event, user_id)
+
+    def set_participants(self, event_id, user_ids):
+        """Replace the participants of the event."""
+
+        event = self._events.get(event_id)
+        if event is None:
+            return
+
+        user_ids = set(user_ids)
+        for user_id in event.users - user_ids:
+            self._unlink(event, user_id)
+        for user_id in user_ids - event.users:
+            self._link(event, user_id)
+
+    def overlapping(self, event_id, user_id):
+        """Return the other events of the user overlapping the event,
+        as EventIntervals.
+        """
+
+        event = self._events.get(event_id)
+        if event is None:
+            return []
+
+        starts = self._starts.get((event.guild_id, user_id), ())
+        lo = bisect.bisect_right(starts, (event.start - self._longest,))
+        hi = bisect.bisect_left(starts, (event.end,))
+
+        overlaps = []
+        for start, other_id in starts[lo:hi]:
+            other = self._events[other_id]
+            if other_id != event_id and other.end > event.start:
+                overlaps.append(other)
+
+        return overlaps
+
+    def _link(self, event, user_id):
+        event.users.add(user_id)
+        starts = self._starts.setdefault((event.guild_id, user_id), [])
+        bisect.insort(starts, (event.start, event.event_id))
+
+    def _unlink(self, event, user_id):
+        event.users.discard(user_id)
+        key = (event.guild_id, user_id)
+        starts = self._starts[key]
+        starts.remove((event.start, event.event_id))
+        if not starts:
+            del self._starts[key]
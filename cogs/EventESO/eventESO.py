@@ -1,10 +1,42 @@
-from collections import defaultdict
+import asyncio
+from collections import Counter, defaultdict
 from datetime import datetime, timedelta
+import functools
+import logging
+import os
+import tempfile
+import time
+
+import aiosqlite
 from dateutil.parser import isoparse
 import discord
 from discord.ext import commands, tasks
-from . import menus
-
+from discord.ext.menus import MenuError
+from . import attendance, menus, migrations
+from .conflicts import ConflictIndex
+from .export import EXPORT_FORMATS, write_export
+from .guilds import GuildConfig, GuildEvents, is_event_admin
+from .lease import Lease
+from .members import MemberCache
+from .metrics import (
+    DB_SECONDS,
+    EMBED_DELAY_SECONDS,
+    EMBED_EDITS,
+    REACTION_SECONDS,
+    REACTIONS,
+    REGISTRY,
+    REST_SECONDS,
+    Gauge,
+    db_query,
+    start_server,
+)
+from .registry import ROLE_TYPES, TEMPLATE_FILES, parse_event_type
+from .scheduler import EventScheduler, utc_naive
+from .writer import ParticipantWriter
+
+log = logging.getLogger(__name__)
+
+# Admin roles of the guilds without their own configuration
 ADMIN_ROLES = [
     612353582628470835,  # Officer
     704199892339261550,  # Senior Officer
@@ -12,6 +44,67 @@ ADMIN_ROLES = [
     758707783330693161,  # Bot Tester Role (don't mind me)
 ]
 
+# Maximum number of concurrent requests when restoring the menus
+RESTORE_CONCURRENCY = 5
+
+# Age after which the finished events are moved to the archive tables
+ARCHIVE_AFTER = timedelta(days=30)
+
+# Number of free DB pages to release after archiving
+VACUUM_PAGES = 1000
+
+# Days between the events of a schedule
+SCHEDULE_INTERVAL_DAYS = 7
+
+# Maximum number of events created by a single bulk command
+BULK_MAX_EVENTS = 50
+
+# Time before its trigger when the menu of a dormant event is started
+ACTIVATE_BEFORE = timedelta(days=1)
+
+# Delay before starting again the menu of a dormant event, after a
+# failure that may be temporary, like a server error
+ACTIVATE_RETRY = timedelta(minutes=1)
+
+# Time in seconds without reactions before a menu is made dormant
+IDLE_EVICT_AFTER = 30 * 60
+
+# Interface of the metrics endpoint, only reachable locally
+METRICS_HOST = "127.0.0.1"
+
+# Metrics of the running menus, exported by event ID
+MENU_METRICS = {
+    'queue_depth': "Reactions waiting in the queue of the menu.",
+    'processed': "Reactions processed by the menu.",
+    'dropped': "Reactions dropped by the menu when it stopped.",
+    'latency_mean': "Mean time in seconds to process a reaction.",
+    'latency_max': "Longest time in seconds to process a reaction.",
+    'edits_requested': "Edits of the message requested by the menu.",
+    'edits_sent': "Edits of the message sent by the menu.",
+    'edits_coalesced': "Edits of the message merged with a pending one.",
+    'edits_skipped': "Edits of the message skipped, as up to date.",
+}
+
+# When several processes share the DB, the leader fires the triggers:
+# time in seconds before its lease expires, and between its renewals
+LEASE_TTL = 6
+LEASE_RENEW = 2
+
+# Delay of the triggers of the events of the other processes, so that
+# their menu first writes its roster to the DB
+REMOTE_TRIGGER_DELAY = timedelta(seconds=1)
+
+# Triggers missed for longer than this, without a leader, are dropped
+TRIGGER_GRACE = timedelta(minutes=5)
+
+# Number of weeks shown by the event statistics, and maximum number of
+# members in the leaderboard
+STATS_WEEKS = 8
+STATS_TOP_MAX = 25
+
+# Number of rows fetched at once from the DB by the exports
+EXPORT_CHUNK = 500
+
 
 class DateTimeISOError(commands.CommandError):
     """Exception raised when the provided argument is not a valid ISO
@@ -33,6 +126,14 @@ class EventRoleNotFound(commands.CommandError):
     """Exception raised when the provided role for the event is not found."""
 
 
+class EventParticipantNotFound(commands.CommandError):
+    """Exception raised when the member is not registered to the event."""
+
+
+class EventScheduleNotFound(commands.CommandError):
+    """Exception raised when there is no schedule at the provided ID."""
+
+
 class DateTimeISO(commands.Converter):
     """Convert a string of ISO time to a datetime object."""
 
@@ -48,31 +149,451 @@ class DateTimeISO(commands.Converter):
 class EventESO(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.running_events = defaultdict(lambda: {'task': None, 'menu': None})
+        # the events are partitioned by guild, with an index of the
+        # guild of each event for the lookups by ID
+        self.guilds = {}
+        self._event_guilds = {}
+        self.guild_configs = {}
+        self.default_config = GuildConfig(ADMIN_ROLES)
+        self._activations = {}
+        self._deactivations = {}
+        self.writer = ParticipantWriter(bot)
+        self.members = MemberCache()
+        self.conflicts = ConflictIndex()
+        self.scheduler = EventScheduler(bot.loop, self._on_trigger)
+        # several processes share the DB, each with some of the shards
+        self.lease = None
+        if bot.shard_ids is not None:
+            self.lease = Lease(bot, "triggers", LEASE_TTL)
+
+        self._metrics_runner = None
+        REGISTRY.register(Gauge(
+            "eventeso_menus",
+            "Events by type, with a running menu or dormant.",
+            ("event_type", "state"),
+            self._count_menus,
+        ))
+        REGISTRY.register(Gauge(
+            "fatebot_startup_seconds",
+            "Duration of the phases of the startup.",
+            ("phase",),
+            lambda: {(k,): v for k, v in bot.startup_phases.items()},
+        ))
+        REGISTRY.register(Gauge(
+            "eventeso_scheduler_pending",
+            "Triggers, activations and schedules waiting in the scheduler.",
+            (),
+            lambda: {(): len(self.scheduler)},
+        ))
+        REGISTRY.register(Gauge(
+            "eventeso_scheduler_next_due_seconds",
+            "Time until the next entry of the scheduler is due.",
+            (),
+            self._next_due_in,
+        ))
+        for key, documentation in MENU_METRICS.items():
+            REGISTRY.register(Gauge(
+                f"eventeso_menu_{key}",
+                documentation,
+                ("event_id",),
+                functools.partial(self._menu_metric, key),
+            ))
+
+        self._startup_task = bot.add_startup_task(self._startup())
+        self.writer.start()
+        self.scheduler.start()
+        self.archive_events.start()
+        self.reload_templates.start()
+        self.evict_menus.start()
+        if self.lease is not None:
+            self.coordinate.start()
+
+    def cog_unload(self):
+        self._startup_task.cancel()
+        if self._metrics_runner is not None:
+            self.bot.add_shutdown_task(self._metrics_runner.cleanup())
+        if self.lease is not None:
+            self.coordinate.cancel()
+            self.bot.add_shutdown_task(self.lease.release())
+        self.evict_menus.cancel()
+        self.reload_templates.cancel()
+        self.archive_events.cancel()
+        self.scheduler.stop()
+        # the changes still queued are written before the DB is closed
+        self.bot.add_shutdown_task(self._stop_menus())
+
+    async def _stop_menus(self):
+        """Process the reactions already received by the running menus
+        and send their pending edits, then write the queued changes.
+        The reactions stay on the messages, for the menus to restart.
+        """
+
+        async def stop(menu):
+            await menu.actor.join()
+            menu.detach()
+            await menu.finish_message(clear_reactions=False)
+
+        menus = list(self.running_events.values())
+        results = await asyncio.gather(
+            *(stop(menu) for menu in menus), return_exceptions=True)
+        for menu, result in zip(menus, results):
+            if isinstance(result, Exception):
+                log.error(
+                    "Could not stop the menu of event %s",
+                    menu.event_id, exc_info=result)
+
+        await self.writer.stop()
+
+    @property
+    def running_events(self):
+        """The running menus of all the guilds, by event ID."""
+
+        return {
+            event_id: menu
+            for guild in self.guilds.values()
+            for event_id, menu in guild.running_events.items()
+        }
+
+    @property
+    def is_leader(self):
+        """True if this process fires the triggers of the events, which
+        is always the case when it is alone.
+        """
+
+        return self.lease is None or self.lease.held
+
+    def is_local(self, guild_id):
+        """True if the guild is served by this process."""
+
+        return self.lease is None or self.bot.get_guild(guild_id) is not None
+
+    def guild_config(self, guild_id):
+        """Return the event settings of the guild."""
+
+        return self.guild_configs.get(guild_id, self.default_config)
+
+    def _guild(self, guild_id):
+        """Return the events of the guild, creating its partition."""
 
-        self._create_tables.start()
-        self.reload_menus.start()
+        guild = self.guilds.get(guild_id)
+        if guild is None:
+            guild = self.guilds[guild_id] = GuildEvents(guild_id)
+
+        return guild
+
+    def _event_guild(self, event_id):
+        """Return the events of the guild of the event, or None."""
+
+        guild_id = self._event_guilds.get(event_id)
+        if guild_id is None:
+            return None
+
+        return self.guilds[guild_id]
+
+    def menu_metrics(self):
+        """Return the metrics of the running menus, by event ID."""
+
+        return {
+            event_id: {
+                'queue_depth': menu.actor.depth,
+                'processed': menu.actor.processed,
+                'dropped': menu.actor.dropped,
+                'latency_mean': menu.actor.latency_mean,
+                'latency_max': menu.actor.latency_max,
+                'edits_requested': menu.updater.requested,
+                'edits_sent': menu.updater.sent,
+                'edits_coalesced': menu.updater.coalesced,
+                'edits_skipped': menu.updater.skipped,
+            }
+            for event_id, menu in self.running_events.items()
+        }
+
+    def _menu_metric(self, key):
+        """Return the metric of the running menus, by event ID."""
+
+        return {
+            (event_id,): metrics[key]
+            for event_id, metrics in self.menu_metrics().items()
+        }
+
+    def _next_due_in(self):
+        """Return the seconds until the scheduler is next due, if any
+        entry is pending.
+        """
+
+        next_due = self.scheduler.next_due
+        if next_due is None:
+            return {}
+
+        return {(): (next_due - datetime.utcnow()).total_seconds()}
+
+    def _count_menus(self):
+        """Return the number of events by (event_type, state)."""
+
+        counts = Counter()
+        for guild in self.guilds.values():
+            counts.update(
+                (menu.event_type, "running")
+                for menu in guild.running_events.values()
+            )
+            counts.update(
+                (event['event_type'], "dormant")
+                for event in guild.dormant_events.values()
+            )
+
+        return counts
+
+    async def _startup(self):
+        """Update the DB tables to the latest schema, then reload the
+        menus once connected.
+        """
+
+        if self.bot.metrics_port is not None:
+            try:
+                self._metrics_runner = await start_server(
+                    REGISTRY, METRICS_HOST, self.bot.metrics_port)
+            except OSError as e:
+                log.error("Could not serve the metrics: %s", e)
+
+        # the migrations manage their own transactions
+        async with self.bot.db_lock:
+            await self.bot.run_phase(
+                "migrate", migrations.migrate(self.bot.db))
+        self.guild_configs = await self._get_guild_configs()
+        await self.bot.wait_until_ready()
+        await self._backfill_guilds()
+        await self._load_preferences()
+        await self._load_conflicts()
+        await self.bot.run_phase("menus", self.reload_menus())
+
+    async def _load_preferences(self):
+        """Load the role preferences of the members of the local guilds."""
+
+        rows = await self._get_preferences()
+        for row in rows:
+            if self.is_local(row['guild_id']):
+                preferences = self._guild(row['guild_id']).preferences
+                preferences[row['user_id']] = (
+                    preferences.get(row['user_id'], frozenset())
+                    | {row['role_type']}
+                )
+
+    async def _load_conflicts(self):
+        """Index the intervals of the active events of the local guilds
+        and their participants, including the dormant ones.
+        """
+
+        rows = await self._get_active_participants()
+        for row in rows:
+            id = row['event_id']
+            if not self.is_local(row['guild_id']):
+                continue
+
+            if id not in self.conflicts:
+                try:
+                    template = menus.TEMPLATES.get(
+                        row['event_type'], row['event_name'])
+                except (KeyError, ValueError):
+                    continue
+
+                self.conflicts.set_event(
+                    id,
+                    row['guild_id'],
+                    utc_naive(row['trigger_at']),
+                    template.duration,
+                    f"{template.title} (Event ID {id:03d})",
+                )
+
+            if row['user_id'] is not None:
+                self.conflicts.set_participant(id, row['user_id'], True)
 
-    @tasks.loop(count=1)
     async def reload_menus(self):
         """Reload the menus upon startup."""
 
+        start = time.perf_counter()
         events = await self._get_events()
 
+        # only the events close to their trigger need their menu now
+        activate_until = datetime.utcnow() + ACTIVATE_BEFORE
+        by_channel = defaultdict(list)
+        dormant = 0
+        remote = 0
         for event in events:
-            channel = (self.bot.get_channel(event['channel_id'])
-                       or await self.bot.fetch_channel(event['channel_id']))
-            message = await channel.fetch_message(event['message_id'])
-            ctx = await self.bot.get_context(message)
+            if event['guild_id'] is None:
+                log.warning(
+                    "Event %s has no known guild, it is not restored.",
+                    event['event_id'])
+            elif not self.is_local(event['guild_id']):
+                # served by another process
+                remote += 1
+            elif utc_naive(event['trigger_at']) > activate_until:
+                self._add_dormant(event)
+                dormant += 1
+            else:
+                by_channel[event['channel_id']].append(event)
+
+        semaphore = asyncio.Semaphore(RESTORE_CONCURRENCY)
+        results = await asyncio.gather(*[
+            self._restore_channel(channel_id, channel_events, semaphore)
+            for channel_id, channel_events in by_channel.items()
+        ])
+
+        log.info(
+            "Restored %d/%d menus in %.2f s, %d events are dormant.",
+            sum(results), len(events) - dormant - remote,
+            time.perf_counter() - start, dormant,
+        )
 
-            id = event['event_id']
-            await self._start_event(ctx, id, message, event)
+        # the events of a schedule are created by the process of its guild
+        schedules = await self._get_schedules()
+        for schedule in schedules:
+            if self.is_local(schedule['guild_id']):
+                self._schedule_next(schedule)
 
-    @reload_menus.before_loop
-    async def reload_menus_before(self):
-        await self.bot.wait_until_ready()
+    async def _restore_channel(self, channel_id, events, semaphore):
+        """Restore the menus of the events in a channel.
+        Return the number of menus restored.
+        """
+
+        try:
+            async with semaphore:
+                channel = await self._fetch_channel(channel_id)
+        except discord.HTTPException as e:
+            log.warning("Could not fetch channel %s: %s", channel_id, e)
+            return 0
+
+        results = await asyncio.gather(*[
+            self._restore_menu(channel, event, semaphore) for event in events
+        ])
+
+        return sum(results)
+
+    async def _restore_menu(self, channel, event, semaphore):
+        """Restore the menu of an event from its message.
+        Return True if the menu was restored.
+        """
+
+        id = event['event_id']
+        try:
+            async with semaphore:
+                message = await self._fetch_message(
+                    channel, event['message_id'], event['event_type'])
+                await self._start_event(channel, id, message, event)
+        except discord.HTTPException as e:
+            log.warning("Could not restore event %s: %s", id, e)
+            return False
+        except Exception:
+            log.exception("Error while restoring event %s.", id)
+            return False
+
+        return True
+
+    @tasks.loop(minutes=5)
+    async def evict_menus(self):
+        """Make dormant the menus of the far-future events without
+        recent reactions, they are started again when needed.
+        """
+
+        def is_idle(menu):
+            return (time.monotonic() - menu.last_active > IDLE_EVICT_AFTER
+                    and menu.actor.depth == 0
+                    and utc_naive(menu.trigger_at) > activate_until)
+
+        activate_until = datetime.utcnow() + ACTIVATE_BEFORE
+        evicted = 0
+        for guild in list(self.guilds.values()):
+            for event_id in list(guild.running_events):
+                # a menu may have received reactions during the last await
+                menu = guild.running_events.get(event_id)
+                if menu is None or not is_idle(menu):
+                    continue
+
+                # one menu failing must not stop the loop
+                try:
+                    await self._deactivate_event(event_id)
+                except Exception:
+                    log.exception("Could not make event %s dormant.", event_id)
+                else:
+                    evicted += 1
+
+        if evicted:
+            log.info("Made %d idle menus dormant.", evicted)
+
+    @evict_menus.before_loop
+    async def evict_menus_before(self):
+        await self.bot.wait_until_fully_ready()
+
+    @tasks.loop(hours=6)
+    async def archive_events(self):
+        """Move the old finished events to the archive, to keep the
+        active tables small.
+        """
+
+        before = datetime.utcnow() - ARCHIVE_AFTER
+        archived = await self._archive_events(before)
+        if not archived:
+            return
+
+        log.info("Archived %d events.", archived)
+        try:
+            await self._vacuum()
+        except aiosqlite.OperationalError as e:
+            # e.g. the DB locked by another process sharing it
+            log.warning("Could not vacuum the DB: %s", e)
+
+    @archive_events.before_loop
+    async def archive_events_before(self):
+        await self.bot.wait_until_fully_ready()
+
+    @tasks.loop(seconds=30)
+    async def reload_templates(self):
+        """Reload the event templates that changed on disk, and
+        update the running menus using them.
+        """
+
+        reloaded = menus.TEMPLATES.reload_if_changed()
+        if not reloaded:
+            return
+
+        log.info("Reloaded the %s templates.", ", ".join(reloaded))
+        for menu in self.running_events.values():
+            if menu.event_type not in reloaded:
+                continue
+
+            try:
+                template = menus.TEMPLATES.get(
+                    menu.event_type, menu.event_name)
+            except KeyError:
+                log.warning(
+                    "Template %s %s was removed, event %s keeps the old one.",
+                    menu.event_type, menu.event_name, menu.event_id)
+                continue
+
+            menu.set_template(template)
+            await menu.update_page()
+
+    @tasks.loop(seconds=LEASE_RENEW)
+    async def coordinate(self):
+        """Keep the leadership of the triggers, or take it over once
+        the lease of the leader expired. The leader then schedules the
+        triggers of the events of the other processes.
+        """
+
+        was_leader = self.is_leader
+        leader = await self.lease.renew()
+        if leader != was_leader:
+            log.info("%s the leader of the triggers.",
+                     "Became" if leader else "No longer")
+
+        if leader:
+            await self._schedule_remote_triggers()
+
+    @coordinate.before_loop
+    async def coordinate_before(self):
+        await self.bot.wait_until_fully_ready()
 
     @commands.command(aliases=["arenas"])
+    @commands.guild_only()
     async def arena(self, ctx, arena_name, *,
                     trigger_at: DateTimeISO = None):
         """Trigger an arena event."""
@@ -85,6 +606,7 @@ class EventESO(commands.Cog):
         )
 
     @commands.command(aliases=["dungeons"])
+    @commands.guild_only()
     async def dungeon(self, ctx, dungeon_name, *,
                       trigger_at: DateTimeISO = None):
         """Trigger a dungeon event."""
@@ -97,6 +619,7 @@ class EventESO(commands.Cog):
         )
 
     @commands.command(aliases=["trials"])
+    @commands.guild_only()
     async def trial(self, ctx, trial_name, *,
                     trigger_at: DateTimeISO = None):
         """Trigger a trial event."""
@@ -122,7 +645,8 @@ class EventESO(commands.Cog):
             )
 
         elif isinstance(error, (EventAbbreviationError,
-                                commands.MissingRequiredArgument)):
+                                commands.MissingRequiredArgument,
+                                commands.NoPrivateMessage)):
             await ctx.send(error)
 
         else:
@@ -134,7 +658,8 @@ class EventESO(commands.Cog):
         """
 
         if trigger_at is None:
-            trigger_at = datetime.utcnow() + timedelta(weeks=1)
+            lead_time = self.guild_config(ctx.guild.id).lead_time
+            trigger_at = datetime.utcnow() + lead_time
 
         event_data = self._get_event_type_data(event_type)
 
@@ -143,15 +668,16 @@ class EventESO(commands.Cog):
                 f"Unknown {ctx.invoked_with} `{event_name}`.")
 
         event_id = await self._create_event(
+            ctx.guild.id,
             event_type,
             event_name,
             trigger_at,
         )
 
-        await self._start_event(ctx, event_id)
+        await self._start_event(ctx.channel, event_id)
 
     @commands.group(aliases=["events"])
-    @commands.has_any_role(*ADMIN_ROLES)
+    @is_event_admin()
     async def event(self, ctx):
         """Command group to administrate event registrations."""
 
@@ -159,9 +685,7 @@ class EventESO(commands.Cog):
     async def event_cancel(self, ctx, event_id: int):
         """Cancel an event of given ID."""
 
-        if event_id not in self.running_events.keys():
-            raise EventIDNotRunning(f"No event running at ID `{event_id}`.")
-
+        await self._get_menu(event_id, ctx.guild.id)
         await self._cancel_event(event_id, stop_event=True, delete_message=True)
 
     @event.command(name="add")
@@ -171,16 +695,15 @@ class EventESO(commands.Cog):
         Must specify the event ID and desired role of the member.
         """
 
-        if event_id not in self.running_events.keys():
-            raise EventIDNotRunning(f"No event running at ID `{event_id}`.")
-
         if role not in menus.ALL_ROLES:
             raise EventRoleNotFound(f"Role {role} is not valid.")
 
-        menu = self.running_events[event_id]['menu']
-        button = menus.BUTTONS[role]
+        menu = await self._get_menu(event_id, ctx.guild.id)
+        if menu.roster.capacity(role) == 0:
+            raise EventRoleNotFound(
+                f"Role {role} is not part of Event ID {event_id}.")
 
-        await self.fake_button_press(menu, member, button)
+        await self.assign(event_id, member.id, role)
 
     @event.command(name="remove")
     async def event_remove(self, ctx, event_id: int, member: discord.Member):
@@ -188,21 +711,19 @@ class EventESO(commands.Cog):
         Must specify the event ID.
         """
 
-        if event_id not in self.running_events.keys():
-            raise EventIDNotRunning(f"No event running at ID `{event_id}`.")
-
-        menu = self.running_events[event_id]['menu']
-        button = menus.BUTTONS['clear']
+        menu = await self._get_menu(event_id, ctx.guild.id)
+        if member.id not in menu.roster:
+            raise EventParticipantNotFound(
+                f"{member.display_name} is not registered to "
+                f"Event ID {event_id}.")
 
-        await self.fake_button_press(menu, member, button)
+        await self.unassign(event_id, member.id)
 
     @event.command(name="edit")
     async def event_edit(self, ctx, event_id: int):
         """Administrator command to edit an event."""
 
-        if event_id not in self.running_events.keys():
-            raise EventIDNotRunning(f"No event running at ID `{event_id}`.")
-
+        registration_menu = await self._get_menu(event_id, ctx.guild.id)
         event_data = await self._get_event_data(event_id)
 
         menu = menus.EditMenu(
@@ -240,75 +761,506 @@ class EventESO(commands.Cog):
 
         await self._edit_event(event_id, to_edit, new_value)
 
-        # cancel the event and restart the menu
-        await self._cancel_event(event_id)
+        # reload the menu in place, and its trigger time
         event_data = await self._get_event_data(event_id)
-        channel = (self.bot.get_channel(event_data['channel_id'])
-                   or await self.bot.fetch_channel(event_data['channel_id']))
-        menu_message = await channel.fetch_message(event_data['message_id'])
-        menu_ctx = await self.bot.get_context(menu_message)
-        await self._start_event(menu_ctx, event_id, menu_message, event_data)
+        registration_menu.reload_data(event_data)
+        self.scheduler.schedule(event_id, registration_menu.trigger_at)
 
         # delete the remaining editing messages
         await ctx.channel.delete_messages(
             [question_message, answer_message, ctx.message])
         await ctx.send(f"Successfully edited Event ID {event_id}!",
                        delete_after=10)
-        await self.running_events[event_id]["menu"].update_page()
+        await registration_menu.update_page()
+
+    @event.command(name="bulk")
+    async def event_bulk(self, ctx, *, events):
+        """Administrator command to create many events at once.
+        Each line gives the type, the abbreviation and the ISO time of
+        an event, for example `trial vSS 2026-10-22 20:00`.
+        """
+
+        lines = [line for line in events.splitlines() if line.strip()]
+        if len(lines) > BULK_MAX_EVENTS:
+            raise commands.BadArgument(
+                f"Cannot create more than {BULK_MAX_EVENTS} events at once.")
+
+        # validate every line before creating any event
+        to_create = []
+        for i, line in enumerate(lines, start=1):
+            try:
+                event_type, event_name, timeiso = line.split(maxsplit=2)
+            except ValueError:
+                raise commands.BadArgument(
+                    f"Line {i}: expected `type abbreviation time`.")
+
+            try:
+                event_type = parse_event_type(event_type)
+                event_type_data = self._get_event_type_data(event_type)
+            except ValueError as e:
+                raise EventAbbreviationError(f"Line {i}: {e}")
+
+            if event_name not in event_type_data.keys():
+                raise EventAbbreviationError(
+                    f"Line {i}: unknown {event_type} `{event_name}`.")
+
+            try:
+                trigger_at = await DateTimeISO().convert(ctx, timeiso)
+            except DateTimeISOError:
+                raise DateTimeISOError(f"Line {i}: wrong time format.")
+
+            to_create.append((event_type, event_name, trigger_at))
+
+        event_ids = await self._create_events(ctx.guild.id, to_create)
+        for event_id in event_ids:
+            await self._start_event(ctx.channel, event_id)
+
+    @event.command(name="recur")
+    async def event_recur(self, ctx, event_type, event_name,
+                          occurrences: int, *, first_at: DateTimeISO):
+        """Administrator command to create a weekly event in this
+        channel, for the given number of weeks. Each event is created
+        ahead of its trigger by the lead time of the guild.
+        """
+
+        try:
+            event_type = parse_event_type(event_type)
+            event_type_data = self._get_event_type_data(event_type)
+        except ValueError as e:
+            raise EventAbbreviationError(e)
+
+        if event_name not in event_type_data.keys():
+            raise EventAbbreviationError(
+                f"Unknown {event_type} `{event_name}`.")
+
+        if occurrences < 1:
+            raise commands.BadArgument("There must be at least one event.")
+
+        schedule = await self._create_schedule(
+            ctx.guild.id,
+            ctx.channel.id,
+            event_type,
+            event_name,
+            first_at,
+            SCHEDULE_INTERVAL_DAYS,
+            occurrences,
+        )
+        self._schedule_next(schedule)
+
+        await ctx.send(
+            f"Created Schedule ID {schedule['schedule_id']}: "
+            f"{event_type_data[event_name].title} every "
+            f"{SCHEDULE_INTERVAL_DAYS} days, {occurrences} times.")
+
+    @event.command(name="schedules")
+    async def event_schedules(self, ctx):
+        """Administrator command to list the recurring events."""
+
+        schedules = await self._get_schedules(ctx.guild.id)
+        if not schedules:
+            await ctx.send("There are no recurring events.")
+            return
+
+        content = []
+        for schedule in schedules:
+            next_at = self._next_occurrence(schedule)
+            content.append(
+                f"`{schedule['schedule_id']}` {schedule['event_type']} "
+                f"`{schedule['event_name']}` in <#{schedule['channel_id']}>, "
+                f"{schedule['created']}/{schedule['occurrences']} created, "
+                f"next at `{next_at.isoformat(sep=' ', timespec='minutes')}`"
+            )
+
+        await ctx.send("\n".join(content))
+
+    @event.command(name="unschedule")
+    async def event_unschedule(self, ctx, schedule_id: int):
+        """Administrator command to stop a recurring event. The events
+        already created are kept.
+        """
+
+        if not await self._delete_schedule(schedule_id, ctx.guild.id):
+            raise EventScheduleNotFound(
+                f"No schedule at ID `{schedule_id}`.")
+
+        self.scheduler.cancel(("schedule", schedule_id))
+        await ctx.send(f"Stopped Schedule ID {schedule_id}.")
+
+    @event.command(name="export")
+    async def event_export(self, ctx, event_type="all", fmt="csv",
+                           since: DateTimeISO = None,
+                           until: DateTimeISO = None):
+        """Administrator command to export the events of the guild and
+        their participants, as a compressed CSV or JSON Lines file.
+        The events can be filtered by type, `all` for every type, and
+        by time, for example `trial csv 2026-01-01 2026-07-01`.
+        """
+
+        fmt = fmt.lower()
+        if fmt not in EXPORT_FORMATS:
+            raise commands.BadArgument(
+                f"Unknown format `{fmt}`, use one of "
+                f"{', '.join(EXPORT_FORMATS)}.")
+
+        if event_type.lower() == "all":
+            event_type = None
+        else:
+            try:
+                event_type = parse_event_type(event_type)
+            except ValueError as e:
+                raise commands.BadArgument(str(e))
+
+        rows = self._iter_history(
+            ctx.guild.id,
+            utc_naive(since) if since else None,
+            utc_naive(until) if until else None,
+            event_type,
+        )
+        filename = f"events-{ctx.guild.id}.{EXPORT_FORMATS[fmt]}.gz"
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, filename)
+            async with ctx.typing():
+                count = await write_export(rows, path, fmt)
+
+            if os.path.getsize(path) > ctx.guild.filesize_limit:
+                await ctx.send(
+                    "The export is too large to be uploaded, try with "
+                    "a shorter time range.")
+                return
+
+            await ctx.send(
+                f"Exported {count} rows.",
+                file=discord.File(path, filename),
+            )
+
+    @event.group(name="config", invoke_without_command=True)
+    async def event_config(self, ctx):
+        """Show the event settings of the guild."""
+
+        config = self.guild_config(ctx.guild.id)
+        roles = ", ".join(f"<@&{role_id}>" for role_id in config.admin_roles)
+        await ctx.send(
+            f"Admin roles: {roles or 'none'}\n"
+            f"Lead time: {config.lead_time}",
+            allowed_mentions=discord.AllowedMentions.none(),
+        )
+
+    @event_config.command(name="roles")
+    @commands.has_guild_permissions(manage_guild=True)
+    async def event_config_roles(self, ctx,
+                                 roles: commands.Greedy[discord.Role]):
+        """Set the roles allowed to administrate the events of the
+        guild, on top of the members who manage the guild.
+        """
+
+        config = self.guild_config(ctx.guild.id)
+        await self._set_guild_config(
+            ctx.guild.id, GuildConfig([role.id for role in roles],
+                                      config.lead_time))
+        await ctx.send(f"Set {len(roles)} admin roles.")
+
+    @event_config.command(name="lead")
+    async def event_config_lead(self, ctx, days: float):
+        """Set the default time between the creation of an event and
+        its trigger, in days.
+        """
+
+        if days <= 0:
+            raise commands.BadArgument("The lead time must be positive.")
+
+        config = self.guild_config(ctx.guild.id)
+        await self._set_guild_config(
+            ctx.guild.id, GuildConfig(config.admin_roles,
+                                      timedelta(days=days)))
+        await ctx.send(f"Set the lead time to {timedelta(days=days)}.")
 
     @event.error
     @event_cancel.error
     @event_add.error
     @event_remove.error
+    @event_bulk.error
+    @event_recur.error
+    @event_unschedule.error
+    @event_export.error
+    @event_config.error
+    @event_config_roles.error
+    @event_config_lead.error
     async def event_admin_error(self, ctx, error):
         """Error handler for the trial administration commands."""
 
         if isinstance(error, (
                 EventIDNotRunning,
                 EventRoleNotFound,
+                EventParticipantNotFound,
+                EventScheduleNotFound,
+                EventAbbreviationError,
+                DateTimeISOError,
+                commands.BadArgument,
+                commands.MissingRequiredArgument,
                 commands.MemberNotFound,
+                commands.NoPrivateMessage,
         )):
             await ctx.send(error)
 
-        elif isinstance(error, commands.MissingAnyRole):
+        elif isinstance(error, (commands.MissingAnyRole,
+                                commands.MissingPermissions)):
             await ctx.send("You do not have the required role(s).")
 
         else:
             raise error
 
-    async def fake_button_press(self, menu, member, button):
-        """Call the function that handles button press with a fake payload."""
-
-        # this is hackish
-        emoji = discord.PartialEmoji(name=button)
-        payload = discord.RawReactionActionEvent(
-            data={
-                'message_id': menu.message.id,
-                'channel_id': menu.message.channel.id,
-                'user_id': member.id,
-                'guild_id': menu.message.guild.id,
-            },
-            emoji=emoji,
-            event_type='REACTION_ADD',
+    async def assign(self, event_id, user_id, role):
+        """Give the role of the event to the user.
+        Return True if the roster of the event changed.
+        """
+
+        menu = await self._get_menu(event_id)
+        return await menu.assign(user_id, role)
+
+    async def unassign(self, event_id, user_id):
+        """Remove the user from the event.
+        Return True if the roster of the event changed.
+        """
+
+        menu = await self._get_menu(event_id)
+        return await menu.unassign(user_id)
+
+    @commands.Cog.listener("on_raw_reaction_add")
+    @commands.Cog.listener("on_raw_reaction_remove")
+    async def on_menu_reaction(self, payload):
+        """Dispatch the reactions on the registration messages to the
+        buttons of their menu.
+        """
+
+        if payload.user_id == self.bot.user.id:
+            return
+
+        guild = self.guilds.get(payload.guild_id)
+        if guild is None:
+            return
+
+        start = time.perf_counter()
+        menu = guild.menus_by_message.get(payload.message_id)
+        if menu is None:
+            event_id = guild.dormant_by_message.get(payload.message_id)
+            if event_id is None:
+                return
+            menu = await self._activate_event(event_id)
+            if menu is None:
+                return
+
+        button = menu.buttons.get(payload.emoji)
+        if button is not None:
+            await button(menu, payload)
+            REACTIONS.inc(event_type=menu.event_type)
+            REACTION_SECONDS.observe(
+                time.perf_counter() - start, event_type=menu.event_type)
+
+    @commands.Cog.listener()
+    async def on_member_update(self, before, after):
+        """Forget the member cached with their old name and roles."""
+
+        self.members.invalidate(after.guild.id, after.id)
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member):
+        self.members.invalidate(member.guild.id, member.id)
+
+    @commands.Cog.listener()
+    async def on_user_update(self, before, after):
+        self.members.invalidate(user_id=after.id)
+
+    @commands.group(invoke_without_command=True)
+    @is_event_admin()
+    async def stats(self, ctx):
+        """Show the latency and throughput metrics of the events.
+        The subcommands show the attendance to the events.
+        """
+
+        def seconds(value):
+            if value is None:
+                return "-"
+            if value == float("inf"):
+                return "slow"
+            if value < 1:
+                return f"{value * 1000:.0f}ms"
+            return f"{value:.1f}s"
+
+        def quantiles(histogram, **labels):
+            return "/".join(
+                seconds(histogram.quantile(q, **labels)) for q in (0.5, 0.99))
+
+        menu_counts = self._count_menus()
+        lines = [
+            f"{'Type':<8}{'Menus':>6}{'Dormant':>8}{'Reacts':>7}"
+            f"{'React p50/99':>14}{'Embed p50/99':>14}{'Edits s/k/c':>13}",
+        ]
+        for event_type in TEMPLATE_FILES:
+            edits = "/".join(
+                str(EMBED_EDITS.value(event_type=event_type, result=result))
+                for result in ("sent", "skipped", "coalesced")
+            )
+            lines.append(
+                f"{event_type:<8}"
+                f"{menu_counts[(event_type, 'running')]:>6}"
+                f"{menu_counts[(event_type, 'dormant')]:>8}"
+                f"{REACTIONS.value(event_type=event_type):>7}"
+                f"{quantiles(REACTION_SECONDS, event_type=event_type):>14}"
+                f"{quantiles(EMBED_DELAY_SECONDS, event_type=event_type):>14}"
+                f"{edits:>13}"
+            )
+
+        menu_metrics = self.menu_metrics().values()
+        latency_max = max(
+            (m['latency_max'] for m in menu_metrics), default=None)
+        lines.append("")
+        lines.append(
+            "Queues: "
+            f"{sum(m['queue_depth'] for m in menu_metrics)} waiting, "
+            f"{sum(m['processed'] for m in menu_metrics)} processed, "
+            f"{sum(m['dropped'] for m in menu_metrics)} dropped, "
+            f"max latency {seconds(latency_max)}")
+        lines.append(
+            f"DB queries: {DB_SECONDS.count()}, "
+            f"p50/p99 {quantiles(DB_SECONDS)}")
+        calls = Counter()
+        for name, labels, value in REST_SECONDS.samples():
+            if name.endswith("_count"):
+                calls[labels["call"]] += value
+        lines.append(
+            f"REST calls: {sum(calls.values())}, "
+            f"p50/p99 {quantiles(REST_SECONDS)}")
+        lines.extend(f"  {call}: {count}" for call, count
+                     in sorted(calls.items()))
+        next_due = self._next_due_in().get(())
+        lines.append(
+            f"Scheduler: {len(self.scheduler)} pending, next in "
+            f"{seconds(max(next_due, 0.0)) if next_due is not None else '-'}")
+        lines.append("Startup: " + ", ".join(
+            f"{phase} {seconds(duration)}"
+            for phase, duration in self.bot.startup_phases.items()))
+
+        content = "\n".join(lines)
+        await ctx.send(f"```\n{content}\n```")
+
+    @stats.command(name="user")
+    @commands.guild_only()
+    async def stats_user(self, ctx, member: discord.Member = None):
+        """Show the participation of a member to the events of the
+        guild, yours by default.
+        """
+
+        member = member or ctx.author
+        user_stats = await self._get_user_stats(ctx.guild.id, member.id)
+        if user_stats is None:
+            await ctx.send(
+                f"{member.display_name} did not take part in any event yet.")
+            return
+
+        roles = await self._get_user_role_stats(ctx.guild.id, member.id)
+        lines = [
+            f"**{member.display_name}** took part in "
+            f"{user_stats['events']} events, the last one on "
+            f"{user_stats['last_at']:%Y-%m-%d}.",
+            f"{menus.BUTTONS['leader']} Leader: {user_stats['led']}",
+        ]
+        lines.extend(
+            f"{menus.BUTTONS[row['role']]} {row['role']}: {row['count']}"
+            for row in roles if row['role'] != "leader"
         )
 
-        if emoji.name == menus.BUTTONS['clear']:
-            await menu.on_clear(payload)
+        await ctx.send("\n".join(lines))
+
+    @stats.command(name="event")
+    @commands.guild_only()
+    async def stats_event(self, ctx, event_type=None):
+        """Show the number of events and their participants, by event
+        and by week.
+        """
+
+        if event_type is not None:
+            try:
+                event_type = parse_event_type(event_type)
+            except ValueError as e:
+                raise commands.BadArgument(str(e))
+
+        events = await self._get_event_stats(ctx.guild.id, event_type)
+        if not events:
+            await ctx.send("No event took place yet.")
+            return
+
+        lines = [f"{'Event':<16}{'Events':>7}{'Avg':>6}"]
+        lines.extend(
+            f"{row['event_type'] + ' ' + row['event_name']:<16}"
+            f"{row['events']:>7}"
+            f"{row['participants'] / row['events']:>6.1f}"
+            for row in events
+        )
+
+        weeks = await self._get_week_stats(ctx.guild.id, STATS_WEEKS)
+        lines.append("")
+        lines.append(f"{'Week of':<16}{'Events':>7}{'Avg':>6}")
+        lines.extend(
+            f"{row['week']:<16}"
+            f"{row['events']:>7}"
+            f"{row['participants'] / row['events']:>6.1f}"
+            for row in weeks
+        )
+
+        content = "\n".join(lines)
+        await ctx.send(f"```\n{content}\n```")
+
+    @stats.command(name="top")
+    @commands.guild_only()
+    async def stats_top(self, ctx, count: int = 10):
+        """Show the members taking part in the most events."""
+
+        count = max(1, min(count, STATS_TOP_MAX))
+        rows = await self._get_leaderboard(ctx.guild.id, count)
+        if not rows:
+            await ctx.send("No event took place yet.")
+            return
+
+        members = await self.members.resolve(
+            ctx.guild, [row['user_id'] for row in rows])
+
+        lines = [f"{'#':>3} {'Member':<24}{'Events':>7}{'Leader':>7}"]
+        for rank, row in enumerate(rows, start=1):
+            member = members.get(row['user_id'])
+            name = member.display_name if member else str(row['user_id'])
+            lines.append(
+                f"{rank:>3} {name[:23]:<24}{row['events']:>7}{row['led']:>7}")
+
+        content = "\n".join(lines)
+        await ctx.send(f"```\n{content}\n```")
+
+    @stats.error
+    @stats_user.error
+    @stats_event.error
+    @stats_top.error
+    async def stats_error(self, ctx, error):
+        """Error handler for the stats commands."""
+
+        if isinstance(error, commands.MissingAnyRole):
+            await ctx.send("You do not have the required role(s).")
+
+        elif isinstance(error, (commands.NoPrivateMessage,
+                                commands.BadArgument)):
+            await ctx.send(error)
+
         else:
-            await menu._button_add_role(payload)
+            raise error
 
     @commands.command(name="list")
     async def _list(self, ctx, event_type):
         """Print the list of events available, and their abbreviation."""
 
-        if event_type.endswith("s"):
-            event_type = event_type[:-1]
-
+        event_type = parse_event_type(event_type)
         event_data = self._get_event_type_data(event_type)
 
         content = []
         for k, v in event_data.items():
-            content.append(f"{v['title']} (`{k}`)")
+            content.append(f"{v.title} (`{k}`)")
 
         await ctx.send("\n".join(content))
 
@@ -322,22 +1274,53 @@ class EventESO(commands.Cog):
         else:
             raise error
 
-    def _get_event_type_data(self, event_type):
-        """Helper command to return the list of event keys."""
+    @commands.command()
+    @commands.guild_only()
+    async def prefer(self, ctx, *role_types: str.lower):
+        """Set the types of role you accept when promoted from the Fill
+        list of an event, e.g. `prefer tank healer`, or `prefer any`.
+        Without argument, show your preferences.
+        """
 
-        if event_type == "arena":
-            event_list = menus.ARENAS_DATA
+        preferences = self._guild(ctx.guild.id).preferences
+        if not role_types:
+            accepted = preferences.get(ctx.author.id)
+            await ctx.send(
+                "You accept "
+                + (", ".join(sorted(accepted)) if accepted else "any role")
+                + " when promoted from Fill."
+            )
+            return
 
-        elif event_type == "dungeon":
-            event_list = menus.DUNGEONS_DATA
+        if role_types == ("any",):
+            role_types = ()
+
+        unknown = set(role_types) - set(ROLE_TYPES)
+        if unknown:
+            raise commands.BadArgument(
+                f"Unknown role types: {', '.join(sorted(unknown))}. "
+                f"Use {', '.join(ROLE_TYPES)} or any."
+            )
 
-        elif event_type == "trial":
-            event_list = menus.TRIALS_DATA
+        await self._set_preferences(
+            ctx.guild.id, ctx.author.id, frozenset(role_types))
+        await ctx.send("Your role preferences are saved.")
+
+    @prefer.error
+    async def prefer_error(self, ctx, error):
+        """Error handler for the prefer command."""
+
+        if isinstance(error, (commands.NoPrivateMessage,
+                              commands.BadArgument)):
+            await ctx.send(error)
 
         else:
-            raise ValueError(f"No known event type {event_type}.")
+            raise error
+
+    def _get_event_type_data(self, event_type):
+        """Helper command to return the list of event keys."""
 
-        return event_list
+        return menus.TEMPLATES.templates(event_type)
 
     @commands.command()
     async def timeiso(self, ctx):
@@ -349,114 +1332,412 @@ class EventESO(commands.Cog):
         utcnow = datetime.utcnow().isoformat(sep=' ', timespec='minutes')
         await ctx.send(f"The time is curently `{utcnow}` UTC!")
 
-    async def _registration_task(self, ctx, **kwargs):
-        """Task helper to start the registration menus and timer."""
+    async def _on_trigger(self, event_id):
+        """Trigger the event if this process is the leader. Otherwise
+        only stop its menu, the leader announces it from the DB.
+        """
 
-        event_data = kwargs.get('event_data')
-        event_id = event_data['event_id']
+        if self.is_leader:
+            await self._trigger_event(event_id)
+        else:
+            await self._cancel_event(event_id)
 
-        menu = menus.RegistrationMenu(**kwargs)
-        self.running_events[event_id]['menu'] = menu
-        await menu.start(ctx)
+    async def _trigger_event(self, event_id):
+        """Stop the registrations and ping the participants of the event
+        once its time has come.
+        """
 
-        await discord.utils.sleep_until(menu.trigger_at)
-        participants = await menu.stop()
+        guild = self._event_guild(event_id)
+        menu = guild.running_events.pop(event_id)
+        del guild.menus_by_message[menu.message.id]
+        del self._event_guilds[event_id]
+        self.conflicts.remove_event(event_id)
+        participants = menu.detach()
 
-        users = set()
-        for user_id in participants:
-            user = (self.bot.get_user(user_id)
-                    or await self.bot.fetch_user(user_id))
-            users.add(user.mention)
+        # the roster is written before the event is added to the
+        # statistics
+        try:
+            await self.writer.flush()
+        except Exception:
+            log.exception(
+                "Could not write the roster of event %s, it is retried "
+                "in the background.", event_id)
 
-        await ctx.send(
-            f"Hey {', '.join(list(users))}! It is time for the "
-            f"{menu.template['title']}."
-        )
-        del self.running_events[event_id]
-        await self._stop_event(event_id)
+        try:
+            if not await self._stop_event(event_id, triggered=True):
+                # already announced by another process
+                return
+
+            await self._announce(
+                menu.message.channel, menu.template, participants)
+        finally:
+            # the announcement does not wait for the rate-limited edits
+            # of the message
+            self.bot.add_shutdown_task(menu.finish_message())
+
+    async def _trigger_remote_event(self, event_id):
+        """Ping the participants of an event without a menu in this
+        process, from its roster in the DB.
+        """
+
+        if not self.is_leader:
+            return
+
+        event = await self._get_event_data(event_id)
+        if event is None or event['is_done']:
+            return
+
+        trigger_at = utc_naive(event['trigger_at']) + REMOTE_TRIGGER_DELAY
+        if trigger_at > datetime.utcnow():
+            # edited since it was scheduled
+            self.scheduler.schedule(
+                event_id, trigger_at, self._trigger_remote_event)
+            return
 
-    async def _start_event(self, ctx, event_id, message=None, event_data=None):
-        """Helper function to start an event."""
+        participants = await self._get_participant_ids(event_id)
+        if not await self._stop_event(event_id, triggered=True):
+            return
+
+        template = menus.TEMPLATES.get(event['event_type'], event['event_name'])
+        channel = await self._fetch_channel(
+            event['channel_id'], event['event_type'])
+        await self._announce(channel, template, participants)
+
+    async def _announce(self, channel, template, participants):
+        """Ping the participants of the event in its channel."""
+
+        # mentions only need the IDs, no need to fetch the users
+        mentions = [f"<@{user_id}>" for user_id in dict.fromkeys(participants)]
+
+        with REST_SECONDS.time(call="send", event_type=template.event_type):
+            await channel.send(
+                f"Hey {', '.join(mentions)}! "
+                f"It is time for the {template.title}.",
+                allowed_mentions=discord.AllowedMentions(users=True),
+            )
+
+    async def _schedule_remote_triggers(self):
+        """Schedule the coming triggers of the events without a menu
+        in this process, like the ones of the other processes, or of
+        a process that stopped.
+        """
+
+        now = datetime.utcnow()
+        events = await self._get_due_events(
+            now - TRIGGER_GRACE, now + timedelta(seconds=LEASE_TTL))
+        for event in events:
+            id = event['event_id']
+            if id in self._event_guilds or id in self.scheduler:
+                continue
+
+            self.scheduler.schedule(
+                id,
+                utc_naive(event['trigger_at']) + REMOTE_TRIGGER_DELAY,
+                self._trigger_remote_event,
+            )
+
+    async def _start_event(self, channel, event_id, message=None,
+                           event_data=None):
+        """Helper function to start an event in the channel."""
 
         if event_data is None:
             event_data = await self._get_event_data(event_id)
 
         id = event_data['event_id']
-        self.running_events[id]['task'] = self.bot.loop.create_task(
-            self._registration_task(
-                ctx,
-                event_data=event_data,
-                timeout=None,
-                message=message,
-                clear_reactions_after=True,
-            )
+        guild = self._guild(channel.guild.id)
+        menu = menus.RegistrationMenu(
+            event_data=event_data,
+            bot=self.bot,
+            writer=self.writer,
+            conflicts=self.conflicts,
+            preferences=guild.preferences,
+            timeout=None,
+            message=message,
+            clear_reactions_after=True,
+        )
+        guild.running_events[id] = menu
+        self._event_guilds[id] = guild.guild_id
+        try:
+            await menu.start(channel=channel)
+        except BaseException:
+            # a menu without its message must not stay registered, and
+            # a dormant event is kept for another activation
+            guild.running_events.pop(id, None)
+            if id not in guild.dormant_events:
+                self._event_guilds.pop(id, None)
+                self.conflicts.remove_event(id)
+            raise
+
+        guild.menus_by_message[menu.message.id] = menu
+        self.scheduler.schedule(id, menu.trigger_at)
+
+    @staticmethod
+    def _next_occurrence(schedule):
+        """Return the time of the next event of the schedule."""
+
+        return schedule['first_at'] + timedelta(
+            days=schedule['interval_days'] * schedule['created'])
+
+    def _schedule_next(self, schedule):
+        """Schedule the creation of the next event of the schedule."""
+
+        if schedule['created'] >= schedule['occurrences']:
+            return
+
+        lead_time = self.guild_config(schedule['guild_id']).lead_time
+        self.scheduler.schedule(
+            ("schedule", schedule['schedule_id']),
+            self._next_occurrence(schedule) - lead_time,
+            self._create_scheduled_event,
         )
 
+    async def _create_scheduled_event(self, key):
+        """Create and start the next event of a schedule, then schedule
+        the one after it. The events missed while the bot was offline
+        are skipped.
+        """
+
+        schedule_id = key[1]
+        schedule = await self._get_schedule(schedule_id)
+        if schedule is None:
+            return
+
+        now = datetime.utcnow()
+        created = schedule['created']
+        interval = timedelta(days=schedule['interval_days'])
+        trigger_at = schedule['first_at'] + interval * created
+        while created < schedule['occurrences'] and trigger_at <= now:
+            created += 1
+            trigger_at += interval
+
+        lead_time = self.guild_config(schedule['guild_id']).lead_time
+        create = (created < schedule['occurrences']
+                  and trigger_at - lead_time <= now)
+        if create:
+            created += 1
+
+        # the progress of the schedule and the event in one transaction,
+        # unless another process sharing the DB already made progress
+        event_id = None
+        async with self.bot.transaction():
+            if not await self._set_schedule_created(
+                    schedule_id, schedule['created'], created):
+                return
+
+            if create:
+                event_id = await self._insert_event(
+                    schedule['guild_id'],
+                    schedule['event_type'],
+                    schedule['event_name'],
+                    trigger_at,
+                )
+
+        schedule = await self._get_schedule(schedule_id)
+        self._schedule_next(schedule)
+
+        if event_id is None:
+            return
+
+        channel_id = schedule['channel_id']
+        try:
+            channel = await self._fetch_channel(
+                channel_id, schedule['event_type'])
+        except discord.HTTPException as e:
+            log.warning(
+                "Could not start event %s of schedule %s: %s",
+                event_id, schedule_id, e)
+            await self._stop_event(event_id)
+            return
+
+        await self._start_event(channel, event_id)
+
+    async def _fetch_channel(self, channel_id, event_type=""):
+        """Return the channel, from the cache if possible. The event
+        type, if for a single event, labels the time of the call.
+        """
+
+        channel = self.bot.get_channel(channel_id)
+        if channel is None:
+            with REST_SECONDS.time(
+                    call="fetch_channel", event_type=event_type):
+                channel = await self.bot.fetch_channel(channel_id)
+
+        return channel
+
+    async def _fetch_message(self, channel, message_id, event_type=""):
+        """Return the message of the channel."""
+
+        with REST_SECONDS.time(call="fetch_message", event_type=event_type):
+            return await channel.fetch_message(message_id)
+
+    async def _get_menu(self, event_id, guild_id=None):
+        """Return the menu of the event, starting it if the event is
+        dormant. If given, the event must belong to the guild.
+        """
+
+        menu = None
+        guild = self._event_guild(event_id)
+        if guild is not None and guild_id in (None, guild.guild_id):
+            menu = guild.running_events.get(event_id)
+            if menu is None and event_id in guild.dormant_events:
+                menu = await self._activate_event(event_id)
+
+        if menu is None:
+            raise EventIDNotRunning(f"No event running at ID `{event_id}`.")
+
+        menu.last_active = time.monotonic()
+        return menu
+
+    def _add_dormant(self, event):
+        """Keep the event without its menu, until its trigger comes
+        close or someone reacts to its message.
+        """
+
+        id = event['event_id']
+        guild = self._guild(event['guild_id'])
+        guild.dormant_events[id] = event
+        guild.dormant_by_message[event['message_id']] = id
+        self._event_guilds[id] = guild.guild_id
+        self.scheduler.schedule(
+            id, event['trigger_at'] - ACTIVATE_BEFORE, self._activate_event)
+
+    async def _activate_event(self, event_id):
+        """Start the menu of a dormant event.
+        Return the menu, or None if it could not be started.
+        """
+
+        # concurrent reactions wait for the same activation, and are
+        # then dispatched in their order of arrival
+        task = self._activations.get(event_id)
+        if task is None:
+            task = self.bot.loop.create_task(self._materialize(event_id))
+            self._activations[event_id] = task
+            task.add_done_callback(
+                lambda t: self._activations.pop(event_id, None))
+
+        return await asyncio.shield(task)
+
+    async def _materialize(self, event_id):
+        guild = self._event_guild(event_id)
+        if guild is None:
+            return None
+
+        event = guild.dormant_events.get(event_id)
+        if event is None:
+            return guild.running_events.get(event_id)
+
+        # the last changes of a menu made dormant must be in the DB
+        deactivation = self._deactivations.get(event_id)
+        if deactivation is not None:
+            await asyncio.shield(deactivation)
+        await self.writer.flush()
+
+        try:
+            channel_id = event['channel_id']
+            channel = await self._fetch_channel(
+                channel_id, event['event_type'])
+            message = await self._fetch_message(
+                channel, event['message_id'], event['event_type'])
+            await self._start_event(channel, event_id, message, event)
+        except (discord.NotFound, discord.Forbidden, MenuError) as e:
+            # the message or the permissions are gone, for good
+            log.warning("Could not activate event %s: %s", event_id, e)
+            self._event_guilds.pop(event_id, None)
+            self.conflicts.remove_event(event_id)
+            menu = None
+        except Exception:
+            # e.g. a server error, the event stays dormant and is
+            # started on the next reaction or the retry
+            log.exception(
+                "Could not activate event %s, retrying later.", event_id)
+            self.scheduler.schedule(
+                event_id, datetime.utcnow() + ACTIVATE_RETRY,
+                self._activate_event)
+            return None
+        else:
+            menu = guild.running_events[event_id]
+
+        del guild.dormant_events[event_id]
+        del guild.dormant_by_message[event['message_id']]
+
+        return menu
+
+    async def _deactivate_event(self, event_id):
+        """Stop the menu of an event and make the event dormant."""
+
+        guild = self._event_guild(event_id)
+        menu = guild.running_events.pop(event_id)
+        del guild.menus_by_message[menu.message.id]
+        # dormant before stopping, so that no reaction is missed
+        self._add_dormant({
+            'event_id': event_id,
+            'guild_id': guild.guild_id,
+            'channel_id': menu.message.channel.id,
+            'message_id': menu.message.id,
+            'event_name': menu.event_name,
+            'event_type': menu.event_type,
+            'trigger_at': menu.trigger_at,
+        })
+
+        task = self.bot.loop.create_task(self._stop_menu(menu))
+        self._deactivations[event_id] = task
+        task.add_done_callback(
+            lambda t: self._deactivations.pop(event_id, None))
+
+        await asyncio.shield(task)
+
+    async def _stop_menu(self, menu):
+        # let the menu finish the changes it already received
+        await menu.actor.join()
+        await menu.stop(clear_reactions=False)
+
     async def _cancel_event(self, event_id, stop_event=False,
                             delete_message=False):
         """Helper function to cancel an event."""
 
-        event_data = await self._get_event_data(event_id)
-        channel = self.bot.get_channel(event_data['channel_id'])
-        message = await channel.fetch_message(event_data['message_id'])
-
-        await self.running_events[event_id]['menu'].stop()
-        self.running_events[event_id]['task'].cancel()
-        del self.running_events[event_id]
+        self.scheduler.cancel(event_id)
+        guild = self._event_guild(event_id)
+        menu = guild.running_events.pop(event_id)
+        del guild.menus_by_message[menu.message.id]
+        del self._event_guilds[event_id]
+        self.conflicts.remove_event(event_id)
+        await menu.stop(clear_reactions=not delete_message)
         if stop_event:
             await self._stop_event(event_id)
 
         if delete_message:
-            await message.delete()
-
-    @tasks.loop(count=1)
-    async def _create_tables(self):
-        """Create the necessary DB tables if they do not exist."""
-
-        await self.bot.db.execute(
-            """
-            CREATE TABLE IF NOT EXISTS eventeso_event(
-                channel_id INTEGER,
-                created_at TIMESTAMP,
-                event_name TEXT      NOT NULL,
-                event_type TEXT      NOT NULL,
-                is_done    INTEGER   NOT NULL,
-                message_id INTEGER,
-                trigger_at TIMESTAMP NOT NULL
-            )
-            """
-        )
-
-        await self.bot.db.execute(
-            """
-            CREATE TABLE IF NOT EXISTS eventeso_participant(
-                event_id INTEGER NOT NULL,
-                role     TEXT    NOT NULL,
-                user_id  INTEGER NOT NULL,
-                FOREIGN KEY (event_id)
-                    REFERENCES eventeso_event (rowid),
-                UNIQUE(event_id, role, user_id)
-            )
-            """
-        )
-
-        await self.bot.db.commit()
-
-    async def _create_event(self, event_type, event_name, trigger_at):
-        """Insert the Event data in the DB."""
+            with REST_SECONDS.time(
+                    call="delete", event_type=menu.event_type):
+                await menu.message.delete()
+
+    @db_query
+    async def _insert_event(self, guild_id, event_type, event_name,
+                            trigger_at):
+        """Insert the Event data in the DB, without committing.
+        Return the ID of the event.
+        """
 
         async with self.bot.db.execute(
                 """
-                INSERT INTO eventeso_event
+                INSERT INTO eventeso_event (channel_id,
+                                            created_at,
+                                            event_name,
+                                            event_type,
+                                            is_done,
+                                            message_id,
+                                            trigger_at,
+                                            guild_id)
                 VALUES (:channel_id,
                         :created_at,
                         :event_name,
                         :event_type,
                         :is_done,
                         :message_id,
-                        :trigger_at)
+                        :trigger_at,
+                        :guild_id)
                 """,
                 {
+                    'guild_id': guild_id,
                     'channel_id': None,
                     'created_at': None,
                     'event_name': event_name,
@@ -468,35 +1749,515 @@ class EventESO(commands.Cog):
         ) as c:
             event_id = c.lastrowid
 
-        await self.bot.db.commit()
+        return event_id
+
+    @db_query
+    async def _create_event(self, guild_id, event_type, event_name,
+                            trigger_at):
+        """Insert the Event data in the DB."""
+
+        async with self.bot.transaction():
+            event_id = await self._insert_event(
+                guild_id, event_type, event_name, trigger_at)
 
         return event_id
 
-    async def _edit_event(self, event_id, to_edit, new_value):
-        """Edit an entry for an event in the DB."""
+    @db_query
+    async def _create_events(self, guild_id, events):
+        """Insert the (event_type, event_name, trigger_at) of many
+        events of the guild in a single transaction.
+        Return the IDs of the events.
+        """
 
-        await self.bot.db.execute(
-            f"""
-            UPDATE eventeso_event
-               SET {to_edit} = :new_value
-             WHERE rowid = :event_id
-            """,
-            {
-                "event_id": event_id,
-                "new_value": new_value,
-            }
+        event_ids = []
+        async with self.bot.transaction():
+            for event_type, event_name, trigger_at in events:
+                event_ids.append(await self._insert_event(
+                    guild_id, event_type, event_name, trigger_at))
+
+        return event_ids
+
+    @db_query
+    async def _create_schedule(self, guild_id, channel_id, event_type,
+                               event_name, first_at, interval_days,
+                               occurrences):
+        """Insert a recurring event in the DB, and return its row."""
+
+        async with self.bot.transaction():
+            async with self.bot.db.execute(
+                    """
+                    INSERT INTO eventeso_schedule (guild_id,
+                                                   channel_id,
+                                                   event_name,
+                                                   event_type,
+                                                   first_at,
+                                                   interval_days,
+                                                   occurrences)
+                    VALUES (:guild_id,
+                            :channel_id,
+                            :event_name,
+                            :event_type,
+                            :first_at,
+                            :interval_days,
+                            :occurrences)
+                    """,
+                    {
+                        'guild_id': guild_id,
+                        'channel_id': channel_id,
+                        'event_name': event_name,
+                        'event_type': event_type,
+                        # stored naive, like the trigger times
+                        'first_at': utc_naive(first_at),
+                        'interval_days': interval_days,
+                        'occurrences': occurrences,
+                    }
+            ) as c:
+                schedule_id = c.lastrowid
+
+        return await self._get_schedule(schedule_id)
+
+    @db_query
+    async def _get_schedule(self, schedule_id):
+        """Get the data on the recurring event from the DB."""
+
+        async with self.bot.db.execute(
+                """
+                SELECT *
+                  FROM eventeso_schedule
+                 WHERE schedule_id = :schedule_id
+                """,
+                {
+                    'schedule_id': schedule_id,
+                }
+        ) as c:
+            row = await c.fetchone()
+
+        return row
+
+    @db_query
+    async def _get_schedules(self, guild_id=None):
+        """Return the list of recurring events with events left to
+        create, of the guild or of all of them.
+        """
+
+        async with self.bot.db.execute(
+                """
+                SELECT *
+                  FROM eventeso_schedule
+                 WHERE created < occurrences
+                   AND (:guild_id IS NULL OR guild_id = :guild_id)
+                """,
+                {
+                    'guild_id': guild_id,
+                }
+        ) as c:
+            rows = await c.fetchall()
+
+        return rows
+
+    @db_query
+    async def _set_schedule_created(self, schedule_id, previous, created):
+        """Update the number of events created by the schedule if it is
+        still the previous one, without committing.
+        Return True if it was updated.
+        """
+
+        async with self.bot.db.execute(
+                """
+                UPDATE eventeso_schedule
+                   SET created = :created
+                 WHERE schedule_id = :schedule_id
+                   AND created = :previous
+                """,
+                {
+                    'schedule_id': schedule_id,
+                    'previous': previous,
+                    'created': created,
+                }
+        ) as c:
+            updated = c.rowcount == 1
+
+        return updated
+
+    @db_query
+    async def _delete_schedule(self, schedule_id, guild_id):
+        """Delete the recurring event of the guild from the DB.
+        Return True if it existed.
+        """
+
+        async with self.bot.transaction():
+            async with self.bot.db.execute(
+                    """
+                    DELETE FROM eventeso_schedule
+                     WHERE schedule_id = :schedule_id
+                       AND guild_id = :guild_id
+                    """,
+                    {
+                        'schedule_id': schedule_id,
+                        'guild_id': guild_id,
+                    }
+            ) as c:
+                deleted = c.rowcount
+
+        return deleted > 0
+
+    @db_query
+    async def _get_guild_configs(self):
+        """Return the event settings of the configured guilds."""
+
+        async with self.bot.db.execute(
+                """
+                SELECT guild_id, lead_time
+                  FROM eventeso_guild
+                """
+        ) as c:
+            guilds = await c.fetchall()
+
+        async with self.bot.db.execute(
+                """
+                SELECT guild_id, role_id
+                  FROM eventeso_guild_admin_role
+                """
+        ) as c:
+            roles = await c.fetchall()
+
+        admin_roles = defaultdict(list)
+        for row in roles:
+            admin_roles[row['guild_id']].append(row['role_id'])
+
+        return {
+            row['guild_id']: GuildConfig(
+                admin_roles[row['guild_id']],
+                timedelta(seconds=row['lead_time']),
+            )
+            for row in guilds
+        }
+
+    @db_query
+    async def _set_guild_config(self, guild_id, config):
+        """Save the event settings of the guild."""
+
+        params = {
+            'guild_id': guild_id,
+            'lead_time': int(config.lead_time.total_seconds()),
+        }
+
+        async with self.bot.transaction():
+            await self.bot.db.execute(
+                """
+                INSERT INTO eventeso_guild (guild_id, lead_time)
+                VALUES (:guild_id, :lead_time)
+                ON CONFLICT (guild_id) DO UPDATE
+                   SET lead_time = excluded.lead_time
+                """,
+                params
+            )
+
+            await self.bot.db.execute(
+                """
+                DELETE FROM eventeso_guild_admin_role
+                 WHERE guild_id = :guild_id
+                """,
+                params
+            )
+
+            await self.bot.db.executemany(
+                """
+                INSERT INTO eventeso_guild_admin_role (guild_id, role_id)
+                VALUES (:guild_id, :role_id)
+                """,
+                [
+                    {'guild_id': guild_id, 'role_id': role_id}
+                    for role_id in config.admin_roles
+                ]
+            )
+
+        self.guild_configs[guild_id] = config
+
+    @db_query
+    async def _get_preferences(self):
+        """Return the role preferences of the members of all guilds."""
+
+        async with self.bot.db.execute(
+                """
+                SELECT *
+                  FROM eventeso_role_preference
+                """
+        ) as c:
+            rows = await c.fetchall()
+
+        return rows
+
+    @db_query
+    async def _set_preferences(self, guild_id, user_id, role_types):
+        """Save the types of role the member accepts when promoted from
+        the Fill list. No types means any role.
+        """
+
+        params = {
+            'guild_id': guild_id,
+            'user_id': user_id,
+        }
+
+        async with self.bot.transaction():
+            await self.bot.db.execute(
+                """
+                DELETE FROM eventeso_role_preference
+                 WHERE guild_id = :guild_id
+                   AND user_id = :user_id
+                """,
+                params
+            )
+
+            await self.bot.db.executemany(
+                """
+                INSERT INTO eventeso_role_preference
+                       (guild_id, user_id, role_type)
+                VALUES (:guild_id, :user_id, :role_type)
+                """,
+                [
+                    {**params, 'role_type': role_type}
+                    for role_type in role_types
+                ]
+            )
+
+        preferences = self._guild(guild_id).preferences
+        if role_types:
+            preferences[user_id] = role_types
+        else:
+            preferences.pop(user_id, None)
+
+    @db_query
+    async def _backfill_guilds(self):
+        """Fill the guild of the events and schedules created before
+        it was stored, from the channels in the cache.
+        """
+
+        tables = ("eventeso_event", "eventeso_event_archive",
+                  "eventeso_schedule")
+        channel_ids = set()
+        for table in tables:
+            async with self.bot.db.execute(
+                    f"""
+                    SELECT DISTINCT channel_id
+                      FROM {table}
+                     WHERE guild_id IS NULL
+                       AND channel_id IS NOT NULL
+                    """
+            ) as c:
+                channel_ids.update(row['channel_id'] for row in
+                                   await c.fetchall())
+
+        params = []
+        for channel_id in channel_ids:
+            channel = self.bot.get_channel(channel_id)
+            if channel is not None:
+                params.append({
+                    'channel_id': channel_id,
+                    'guild_id': channel.guild.id,
+                })
+
+        if not params:
+            return
+
+        async with self.bot.transaction():
+            for table in tables:
+                await self.bot.db.executemany(
+                    f"""
+                    UPDATE {table}
+                       SET guild_id = :guild_id
+                     WHERE channel_id = :channel_id
+                       AND guild_id IS NULL
+                    """,
+                    params
+                )
+
+            # the events without a guild were left out of the statistics
+            await attendance.rebuild(self.bot.db)
+        log.info("Filled the guild of the events of %d channels.",
+                 len(params))
+
+    async def _iter_history(self, guild_id, since=None, until=None,
+                            event_type=None):
+        """Yield the events of the guild, archived then active, with a
+        row per participant. The rows are fetched in chunks, and events
+        without participants have a single row without user.
+        """
+
+        params = {
+            'guild_id': guild_id,
+            'since': since,
+            'until': until,
+            'event_type': event_type,
+        }
+        # each table in the order of its primary key, so that SQLite
+        # does not need to sort the whole history
+        tables = (
+            ("eventeso_event_archive", "eventeso_participant_archive"),
+            ("eventeso_event", "eventeso_participant"),
         )
+        for events, participants in tables:
+            async with self.bot.db.execute(
+                    f"""
+                    SELECT e.event_id,
+                           e.event_type,
+                           e.event_name,
+                           e.trigger_at,
+                           e.is_done,
+                           p.role,
+                           p.user_id
+                      FROM {events} AS e
+                      LEFT JOIN {participants} AS p
+                        ON p.event_id = e.event_id
+                     WHERE e.guild_id = :guild_id
+                       AND (:since IS NULL OR e.trigger_at >= :since)
+                       AND (:until IS NULL OR e.trigger_at < :until)
+                       AND (:event_type IS NULL
+                            OR e.event_type = :event_type)
+                     ORDER BY e.event_id
+                    """,
+                    params
+            ) as c:
+                c.iter_chunk_size = EXPORT_CHUNK
+                async for row in c:
+                    yield row
+
+    @db_query
+    async def _get_user_stats(self, guild_id, user_id):
+        """Return the attendance of the user in the guild, or None."""
 
-        await self.bot.db.commit()
+        async with self.bot.db.execute(
+                """
+                SELECT *
+                  FROM eventeso_stats_user
+                 WHERE guild_id = :guild_id
+                   AND user_id = :user_id
+                """,
+                {
+                    'guild_id': guild_id,
+                    'user_id': user_id,
+                }
+        ) as c:
+            row = await c.fetchone()
+
+        return row
+
+    @db_query
+    async def _get_user_role_stats(self, guild_id, user_id):
+        """Return the number of events of the user in each role."""
+
+        async with self.bot.db.execute(
+                """
+                SELECT role, count
+                  FROM eventeso_stats_role
+                 WHERE guild_id = :guild_id
+                   AND user_id = :user_id
+                 ORDER BY count DESC
+                """,
+                {
+                    'guild_id': guild_id,
+                    'user_id': user_id,
+                }
+        ) as c:
+            rows = await c.fetchall()
+
+        return rows
+
+    @db_query
+    async def _get_event_stats(self, guild_id, event_type=None):
+        """Return the number of events and participants of the guild by
+        event, of the type or of all of them.
+        """
+
+        async with self.bot.db.execute(
+                """
+                SELECT *
+                  FROM eventeso_stats_event
+                 WHERE guild_id = :guild_id
+                   AND (:event_type IS NULL OR event_type = :event_type)
+                 ORDER BY events DESC
+                """,
+                {
+                    'guild_id': guild_id,
+                    'event_type': event_type,
+                }
+        ) as c:
+            rows = await c.fetchall()
+
+        return rows
+
+    @db_query
+    async def _get_week_stats(self, guild_id, weeks):
+        """Return the number of events and participants of the guild in
+        its last weeks with events.
+        """
+
+        async with self.bot.db.execute(
+                """
+                SELECT *
+                  FROM eventeso_stats_week
+                 WHERE guild_id = :guild_id
+                 ORDER BY week DESC
+                 LIMIT :weeks
+                """,
+                {
+                    'guild_id': guild_id,
+                    'weeks': weeks,
+                }
+        ) as c:
+            rows = await c.fetchall()
+
+        return rows
+
+    @db_query
+    async def _get_leaderboard(self, guild_id, limit):
+        """Return the attendance of the users of the guild taking part
+        in the most events.
+        """
+
+        async with self.bot.db.execute(
+                """
+                SELECT *
+                  FROM eventeso_stats_user
+                 WHERE guild_id = :guild_id
+                 ORDER BY events DESC
+                 LIMIT :limit
+                """,
+                {
+                    'guild_id': guild_id,
+                    'limit': limit,
+                }
+        ) as c:
+            rows = await c.fetchall()
+
+        return rows
+
+    @db_query
+    async def _edit_event(self, event_id, to_edit, new_value):
+        """Edit an entry for an event in the DB."""
+
+        async with self.bot.transaction():
+            await self.bot.db.execute(
+                f"""
+                UPDATE eventeso_event
+                   SET {to_edit} = :new_value
+                 WHERE event_id = :event_id
+                """,
+                {
+                    "event_id": event_id,
+                    "new_value": new_value,
+                }
+            )
 
+    @db_query
     async def _get_event_data(self, event_id):
         """Get the data on the event from the DB and cache it."""
 
         async with self.bot.db.execute(
                 """
-                SELECT rowid AS event_id, *
+                SELECT *
                   FROM eventeso_event
-                 WHERE rowid = :event_id
+                 WHERE event_id = :event_id
                 """,
                 {
                     'event_id': event_id,
@@ -506,12 +2267,13 @@ class EventESO(commands.Cog):
 
         return row
 
+    @db_query
     async def _get_events(self):
         """Return the list of events that are still active."""
 
         async with self.bot.db.execute(
                 """
-                SELECT rowid AS event_id, *
+                SELECT *
                   FROM eventeso_event
                  WHERE trigger_at > :now
                    AND is_done = 0
@@ -524,18 +2286,203 @@ class EventESO(commands.Cog):
 
         return rows
 
-    async def _stop_event(self, event_id):
-        """Mark the event as finished in the DB."""
-
-        await self.bot.db.execute(
-            """
-            UPDATE eventeso_event
-               SET is_done = 1
-             WHERE rowid = :event_id
-            """,
-            {
-                'event_id': event_id,
+    @db_query
+    async def _get_due_events(self, since, until):
+        """Return the list of active events with a message, triggering
+        in the given interval.
+        """
+
+        async with self.bot.db.execute(
+                """
+                SELECT *
+                  FROM eventeso_event
+                 WHERE is_done = 0
+                   AND trigger_at > :since
+                   AND trigger_at <= :until
+                   AND message_id IS NOT NULL
+                """,
+                {
+                    'since': since,
+                    'until': until,
+                }
+        ) as c:
+            rows = await c.fetchall()
+
+        return rows
+
+    @db_query
+    async def _get_active_participants(self):
+        """Return the active events, with a row for each of their
+        participants in a role.
+        """
+
+        async with self.bot.db.execute(
+                """
+                SELECT e.event_id,
+                       e.guild_id,
+                       e.event_type,
+                       e.event_name,
+                       e.trigger_at,
+                       p.user_id
+                  FROM eventeso_event AS e
+                  LEFT JOIN eventeso_participant AS p
+                    ON p.event_id = e.event_id
+                   AND p.role NOT IN ('leader', 'fill')
+                 WHERE e.is_done = 0
+                   AND e.trigger_at > :now
+                   AND e.guild_id IS NOT NULL
+                """,
+                {
+                    'now': datetime.utcnow(),
+                }
+        ) as c:
+            rows = await c.fetchall()
+
+        return rows
+
+    @db_query
+    async def _get_participant_ids(self, event_id):
+        """Return the IDs of the participants of the event, in their
+        order of registration.
+        """
+
+        async with self.bot.db.execute(
+                """
+                SELECT user_id
+                  FROM eventeso_participant
+                 WHERE event_id = :event_id
+                 ORDER BY rowid
+                """,
+                {
+                    'event_id': event_id,
+                }
+        ) as c:
+            rows = await c.fetchall()
+
+        return [row['user_id'] for row in rows]
+
+    @db_query
+    async def _stop_event(self, event_id, triggered=False):
+        """Mark the event as finished in the DB, and add it to the
+        attendance statistics if it was triggered rather than cancelled.
+        Return False if it already was, e.g. by another process.
+        """
+
+        async with self.bot.transaction():
+            async with self.bot.db.execute(
+                    """
+                    UPDATE eventeso_event
+                       SET is_done = 1
+                     WHERE event_id = :event_id
+                       AND is_done = 0
+                    """,
+                    {
+                        'event_id': event_id,
+                    }
+            ) as c:
+                stopped = c.rowcount == 1
+
+            if stopped and triggered:
+                await attendance.record_event(self.bot.db, event_id)
+
+        return stopped
+
+    @db_query
+    async def _archive_events(self, before):
+        """Move the events finished before the given time, and their
+        participants, to the archive tables.
+        Return the number of events archived.
+        """
+
+        async with self.bot.transaction():
+            async with self.bot.db.execute(
+                    """
+                    SELECT MAX(event_id)
+                      FROM eventeso_event
+                    """
+            ) as c:
+                max_event_id = (await c.fetchone())[0]
+
+            params = {
+                'before': before,
+                # the latest event is never archived, so that its ID is not
+                # reused by the next event
+                'max_event_id': max_event_id,
             }
-        )
 
-        await self.bot.db.commit()
+            await self.bot.db.execute(
+                """
+                INSERT INTO eventeso_event_archive
+                SELECT *
+                  FROM eventeso_event
+                 WHERE is_done = 1
+                   AND trigger_at < :before
+                   AND event_id < :max_event_id
+                """,
+                params
+            )
+
+            await self.bot.db.execute(
+                """
+                INSERT INTO eventeso_participant_archive
+                SELECT *
+                  FROM eventeso_participant
+                 WHERE event_id IN (SELECT event_id
+                                      FROM eventeso_event
+                                     WHERE is_done = 1
+                                       AND trigger_at < :before
+                                       AND event_id < :max_event_id)
+                """,
+                params
+            )
+
+            # deleted explicitly, as the cascade only applies with the
+            # foreign keys enforced by the profile of the DB
+            await self.bot.db.execute(
+                """
+                DELETE FROM eventeso_participant
+                 WHERE event_id IN (SELECT event_id
+                                      FROM eventeso_event
+                                     WHERE is_done = 1
+                                       AND trigger_at < :before
+                                       AND event_id < :max_event_id)
+                """,
+                params
+            )
+
+            async with self.bot.db.execute(
+                    """
+                    DELETE FROM eventeso_event
+                     WHERE is_done = 1
+                       AND trigger_at < :before
+                       AND event_id < :max_event_id
+                    """,
+                    params
+            ) as c:
+                archived = c.rowcount
+
+        return archived
+
+    @db_query
+    async def _vacuum(self):
+        """Release the free pages of the DB file."""
+
+        # no change may be in progress, and what is pending is committed
+        # first, as VACUUM cannot run in a transaction
+        async with self.bot.db_lock:
+            await self.bot.db.commit()
+
+            async with self.bot.db.execute("PRAGMA auto_vacuum") as c:
+                auto_vacuum = (await c.fetchone())[0]
+
+            if auto_vacuum != 2:  # 2: INCREMENTAL
+                # the mode of an existing DB only changes with a full
+                # VACUUM
+                await self.bot.db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                await self.bot.db.execute("VACUUM")
+
+            else:
+                # the script steps the statement to the end, one call
+                # freeing all the pages, where execute only frees one
+                await self.bot.db.executescript(
+                    f"PRAGMA incremental_vacuum({VACUUM_PAGES:d})")
@@ -0,0 +1,45 @@
+import csv
+import gzip
+import json
+
+# Columns of the exports, one row per participant of each event
+EXPORT_COLUMNS = (
+    "event_id",
+    "event_type",
+    "event_name",
+    "trigger_at",
+    "is_done",
+    "role",
+    "user_id",
+)
+
+# File extension of each export format, before the compression
+EXPORT_FORMATS = {
+    "csv": "csv",
+    "json": "jsonl",
+}
+
+
+async def write_export(rows, path, fmt):
+    """Write the rows of an async iterator to a gzip file at path, as
+    CSV or as JSON Lines. The rows are written as they come, so that
+    the memory use does not depend on their number.
+    Return the number of rows written.
+    """
+
+    count = 0
+    with gzip.open(path, "wt", encoding="utf-8", newline="") as f:
+        if fmt == "csv":
+            writer = csv.writer(f)
+            writer.writerow(EXPORT_COLUMNS)
+            async for row in rows:
+                writer.writerow(row[column] for column in EXPORT_COLUMNS)
+                count += 1
+
+        else:
+            async for row in rows:
+                data = {column: row[column] for column in EXPORT_COLUMNS}
+                f.write(json.dumps(data, default=str) + "\n")
+                count += 1
+
+    return count
@@ -0,0 +1,60 @@
+from datetime import timedelta
+
+from discord.ext import commands
+
+# Time between the creation of an event and its trigger, by default
+DEFAULT_LEAD_TIME = timedelta(weeks=1)
+
+
+class GuildConfig:
+    """Event settings of a guild."""
+
+    __slots__ = ("admin_roles", "lead_time")
+
+    def __init__(self, admin_roles=(), lead_time=DEFAULT_LEAD_TIME):
+        self.admin_roles = frozenset(admin_roles)
+        self.lead_time = lead_time
+
+    def __repr__(self):
+        return (f"<GuildConfig admin_roles={sorted(self.admin_roles)} "
+                f"lead_time={self.lead_time}>")
+
+
+class GuildEvents:
+    """In-memory state of the events of a guild.
+
+    Each guild keeps its own indexes of running menus and dormant
+    events, so that the lookups and scans of a guild never go through
+    the events of the others.
+    """
+
+    def __init__(self, guild_id):
+        self.guild_id = guild_id
+        self.running_events = {}
+        self.menus_by_message = {}
+        # far-future events without a menu, only their DB row
+        self.dormant_events = {}
+        self.dormant_by_message = {}
+        # user_id: types of role accepted when promoted from Fill
+        self.preferences = {}
+
+
+def is_event_admin():
+    """Check that the author can administrate the events of the guild:
+    they manage the guild, or have one of its admin roles.
+    """
+
+    async def predicate(ctx):
+        if ctx.guild is None:
+            raise commands.NoPrivateMessage()
+
+        if ctx.author.guild_permissions.manage_guild:
+            return True
+
+        admin_roles = ctx.cog.guild_config(ctx.guild.id).admin_roles
+        if any(role.id in admin_roles for role in ctx.author.roles):
+            return True
+
+        raise commands.MissingAnyRole(sorted(admin_roles))
+
+    return commands.check(predicate)
@@ -0,0 +1,92 @@
+import logging
+import os
+import socket
+import time
+
+import aiosqlite
+
+from .metrics import db_query
+
+log = logging.getLogger(__name__)
+
+
+class Lease:
+    """Lease on a name in the DB, held by at most one of the processes
+    sharing the DB.
+
+    The holder renews it before it expires, and another process can
+    only take it once it expired. The times are from the wall clock, as
+    the processes share the DB file and then the host.
+    """
+
+    def __init__(self, bot, name, ttl, holder=None):
+        self.bot = bot
+        self.name = name
+        self.ttl = ttl
+        self.holder = holder or f"{socket.gethostname()}:{os.getpid()}"
+        self._expires_at = None
+
+    @property
+    def held(self):
+        """True while the lease is held and not expired."""
+
+        return self._expires_at is not None and time.time() < self._expires_at
+
+    @db_query
+    async def renew(self):
+        """Acquire the lease, or extend it if already held.
+        Return True if it is held.
+        """
+
+        now = time.time()
+        try:
+            async with self.bot.transaction():
+                async with self.bot.db.execute(
+                        """
+                        INSERT INTO eventeso_lease (name, holder, expires_at)
+                        VALUES (:name, :holder, :expires_at)
+                            ON CONFLICT (name) DO UPDATE
+                           SET holder = excluded.holder,
+                               expires_at = excluded.expires_at
+                         WHERE holder = excluded.holder
+                            OR expires_at < :now
+                        """,
+                        {
+                            'name': self.name,
+                            'holder': self.holder,
+                            'expires_at': now + self.ttl,
+                            'now': now,
+                        }
+                ) as c:
+                    acquired = c.rowcount == 1
+
+        except aiosqlite.OperationalError as e:
+            # e.g. the DB stayed locked by another process, the lease
+            # is then kept until it expires
+            log.warning("Could not renew the lease %s: %s", self.name, e)
+            return self.held
+
+        self._expires_at = now + self.ttl if acquired else None
+        return acquired
+
+    @db_query
+    async def release(self):
+        """Let the other processes take the lease right away."""
+
+        if self._expires_at is None:
+            return
+
+        self._expires_at = None
+        async with self.bot.transaction():
+            await self.bot.db.execute(
+                """
+                UPDATE eventeso_lease
+                   SET expires_at = 0
+                 WHERE name = :name
+                   AND holder = :holder
+                """,
+                {
+                    'name': self.name,
+                    'holder': self.holder,
+                }
+            )
@@ -0,0 +1,63 @@
+import time
+
+# Maximum number of user IDs per member query to the gateway
+QUERY_LIMIT = 100
+
+
+class MemberCache:
+    """Cache of guild members resolved in bulk, with a time to live.
+
+    Members missing from both this cache and the guild's cache are
+    queried together through the gateway, instead of one REST call
+    per user.
+    """
+
+    def __init__(self, ttl=600.0):
+        self.ttl = ttl
+        self._members = {}
+
+    async def resolve(self, guild, user_ids):
+        """Return a dict of user ID to Member for the given users.
+        Users that are not members of the guild are left out.
+        """
+
+        now = time.monotonic()
+        found = {}
+        missing = []
+
+        for user_id in dict.fromkeys(user_ids):
+            cached = self._members.get((guild.id, user_id))
+            if cached is not None and cached[0] > now:
+                found[user_id] = cached[1]
+                continue
+
+            member = guild.get_member(user_id)
+            if member is not None:
+                found[user_id] = member
+            else:
+                missing.append(user_id)
+
+        for i in range(0, len(missing), QUERY_LIMIT):
+            members = await guild.query_members(
+                user_ids=missing[i:i + QUERY_LIMIT], cache=True)
+            for member in members:
+                found[member.id] = member
+
+        expires = now + self.ttl
+        for user_id, member in found.items():
+            self._members[(guild.id, user_id)] = (expires, member)
+
+        return found
+
+    def invalidate(self, guild_id=None, user_id=None):
+        """Forget the cached members of a guild, of a user, or all."""
+
+        if guild_id is not None and user_id is not None:
+            self._members.pop((guild_id, user_id), None)
+            return
+
+        self._members = {
+            key: value for key, value in self._members.items()
+            if (guild_id is not None and key[0] != guild_id)
+            or (user_id is not None and key[1] != user_id)
+        }
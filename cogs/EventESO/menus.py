@@ -1,14 +1,18 @@
-from collections import defaultdict
-import itertools
+import copy
 import json
 import os
+import time
 
 import discord
 from discord.ext import menus
 
+from .actor import EventActor
+from .metrics import EMBED_DELAY_SECONDS, EMBED_EDITS, REST_SECONDS, db_query
+from .registry import ALL_ROLES, TemplateRegistry, role_type
+from .roster import Roster
+from .scheduler import utc_naive
+from .updater import EmbedUpdater
 
-ALL_ROLES = [f"{role}{i}" for role, i in
-             itertools.product(["dps", "healer", "tank"], range(4))]
 
 BUTTONS = {
     "dps0": "<:dps0:818209538846621726>",
@@ -29,27 +33,39 @@ BUTTONS = {
 }
 REVERSE_BUTTONS = {v: k for k, v in BUTTONS.items()}
 
-BASE_DICT = {role: {"name": None, "amount": 0} for role in ALL_ROLES}
-
 template_path = os.path.join(os.path.dirname(__file__), "templates")
-with open(os.path.join(template_path, "arenas.json")) as f:
-    ARENAS_DATA = json.load(f)
-with open(os.path.join(template_path, "dungeons.json")) as f:
-    DUNGEONS_DATA = json.load(f)
-with open(os.path.join(template_path, "trials.json")) as f:
-    TRIALS_DATA = json.load(f)
+TEMPLATES = TemplateRegistry(template_path, BUTTONS)
 
 EMBED_COLOR = 0x200972
 
+# Minimum time in seconds between two edits of a registration message
+UPDATE_INTERVAL = 1.0
+
 
 class RegistrationMenu(menus.Menu):
     """Menu for the role selection in an Event."""
 
     def __init__(self, *args, **kwargs):
         event_data = kwargs.pop('event_data')
+        bot = kwargs.pop('bot', None)
+        self.writer = kwargs.pop('writer')
+        self.conflicts = kwargs.pop('conflicts', None)
+        self.preferences = kwargs.pop('preferences', {})
+        self.actor = EventActor()
+        self.updater = EmbedUpdater(
+            self._edit_page,
+            kwargs.pop('update_interval', UPDATE_INTERVAL),
+            self._observe_edit,
+        )
         self.load_data(event_data)
+        self.roster = Roster(self.template.amounts)
+        self._skeleton = None
+        self._embed_hash = None
+        self._reactions_task = None
+        self.last_active = time.monotonic()
 
         super().__init__(*args, **kwargs)
+        self.bot = bot
 
         # add the buttons upon instanciation
         for role in ALL_ROLES:
@@ -65,51 +81,135 @@ class RegistrationMenu(menus.Menu):
         self.event_id = event_data['event_id']
         self.event_name = event_data['event_name']
         self.event_type = event_data['event_type']
+        self.template = TEMPLATES.get(self.event_type, self.event_name)
+
+    def reload_data(self, event_data):
+        """Reload the data of the event after it was edited, keeping
+        the participants.
+        """
 
-        if self.event_type == "arena":
-            template = ARENAS_DATA[self.event_name]
+        self.load_data(event_data)
+        # reset what depends on the template, as it may have changed
+        self.set_template(self.template)
+
+    async def start(self, ctx=None, *, channel=None, wait=False):
+        """Send the menu, or rebuild its roster from the DB when
+        reloading it, and add the reactions.
+
+        The context can be omitted if the menu was given the bot and
+        the channel, like for the events created by a schedule.
+        The menu does not listen to the reactions itself, the cog
+        dispatches them to the buttons of the menu.
+        """
 
-        elif self.event_type == "dungeon":
-            template = DUNGEONS_DATA[self.event_name]
+        if ctx is not None:
+            self.bot = ctx.bot
+            self.ctx = ctx
+        channel = channel or ctx.channel
+        self._verify_permissions(
+            ctx, channel, channel.permissions_for(channel.guild.me))
 
-        elif self.event_type == "trial":
-            template = TRIALS_DATA[self.event_name]
+        if self.message is None:
+            self.message = await self.send_initial_message(ctx, channel)
         else:
-            raise ValueError
+            await self.load_roster()
 
-        self.template = BASE_DICT | template
+        self._index_event()
+        self._running = True
+        self.actor.start()
+        self._reactions_task = self.bot.loop.create_task(
+            self._sync_reactions())
+
+    async def _sync_reactions(self):
+        """Add the reactions of the buttons missing from the message,
+        and remove those of the roles the event no longer has.
+        """
+
+        present = {
+            str(reaction.emoji) for reaction in self.message.reactions
+            if reaction.me
+        }
+        for emoji in self.buttons:
+            if str(emoji) not in present:
+                with REST_SECONDS.time(
+                    call="add_reaction", event_type=self.event_type):
+                    await self.message.add_reaction(emoji)
+
+        buttons = {str(emoji) for emoji in self.buttons}
+        for emoji in present - buttons:
+            if emoji in REVERSE_BUTTONS:
+                with REST_SECONDS.time(
+                    call="remove_reaction", event_type=self.event_type):
+                    await self.message.remove_reaction(emoji, self.bot.user)
 
     async def send_initial_message(self, ctx, channel):
         """Send the initial, empty Embed for the registration."""
 
-        self.message = await channel.send("Getting things ready...")
+        with REST_SECONDS.time(call="send", event_type=self.event_type):
+            self.message = await channel.send("Getting things ready...")
         # update DB with message details
         await self._update_event()
-        participants = await self._get_participants()
-        embed = self.build_embed(participants)
-        await self.message.edit(content=None, embed=embed)
+        await self.load_roster()
+        embed = self.build_embed()
+        with REST_SECONDS.time(call="edit", event_type=self.event_type):
+            await self.message.edit(content=None, embed=embed)
+        self._embed_hash = self._hash_embed(embed)
         return self.message
 
-    def reaction_check(self, payload):
-        """Override the function to allow for everyone to react."""
+    async def load_roster(self):
+        """Load the participants of the event from the DB.
+        The roster is then only kept up to date in memory.
+        """
 
-        if payload.message_id != self.message.id:
-            return False
+        participants = await self._get_participants()
+        self.roster = Roster.from_rows(self.template.amounts, participants)
+        if self.conflicts is not None:
+            self.conflicts.set_participants(
+                self.event_id,
+                [user_id for user_id in self.roster.user_ids()
+                 if self._in_role(user_id)],
+            )
 
-        if payload.user_id == self.bot.user.id:
-            return False
+    async def stop(self, clear_reactions=True):
+        """Stop the menu, and return the IDs of the participants."""
 
-        return payload.emoji in self.buttons
+        user_ids = self.detach()
+        await self.writer.flush()
+        await self.finish_message(clear_reactions)
 
-    async def stop(self):
-        participants = await self._get_participants()
-        user_ids = [user['user_id'] for user in participants]
+        return user_ids
+
+    def detach(self):
+        """Stop processing the reactions, and return the IDs of the
+        participants. The changes already made are still written.
+        """
+
+        user_ids = self.roster.user_ids()
         super().stop()
+        self.actor.stop()
+        if self._reactions_task is not None:
+            self._reactions_task.cancel()
+
         return user_ids
 
+    async def finish_message(self, clear_reactions=True):
+        """Send the pending edit of the message, then clear its
+        reactions.
+        """
+
+        await self.updater.flush()
+
+        if clear_reactions and self.clear_reactions_after:
+            try:
+                with REST_SECONDS.time(
+                    call="clear_reactions", event_type=self.event_type):
+                    await self.message.clear_reactions()
+            except discord.HTTPException:
+                pass
+
     def _skip_role(self, role):
         def check(menu):
-            return menu.template[role]['amount'] == 0
+            return menu.template.amount(role) == 0
         return check
 
     # better way than write all the functions?
@@ -123,41 +223,23 @@ class RegistrationMenu(menus.Menu):
     async def on_leader(self, payload):
         """Add the Leader role to the user."""
 
-        participants = await self._get_participants()
-        user_ids = [user['user_id'] for user in participants]
-        if payload.user_id not in user_ids:
-            # do not let unregistered users in the Leader role
-            return
-
-        role_list = self._classify_roles(participants)
-        if len(role_list["leader"]) == 1:
-            # no more than one Leader
-            return
-
-        await self._add_event_role(payload.user_id, "leader")
-        await self.update_page()
+        await self.assign(payload.user_id, "leader")
 
     @menus.button(BUTTONS["fill"], position=menus.Last(0))
     async def on_fill(self, payload):
         """Add the user to the Fill list."""
 
-        await self._clear_participant(payload.user_id)
-        await self._add_event_role(payload.user_id, "fill")
-        await self.update_page()
+        await self.assign(payload.user_id, "fill")
 
     @menus.button(BUTTONS["clear"], position=menus.Last(1))
     async def on_clear(self, payload):
         """Remove yourself from the event."""
 
-        await self._clear_participant(payload.user_id)
-        await self.update_page()
+        await self.unassign(payload.user_id)
 
     async def _button_add_role(self, payload):
         """Helper function to add the user to a role."""
 
-        participants = await self._get_participants()
-        user_ids = [user['user_id'] for user in participants]
-        role_list = self._classify_roles(participants)
         try:
             # unicode emoji
             react_role = REVERSE_BUTTONS[payload.emoji.name]
@@ -166,46 +248,204 @@ class RegistrationMenu(menus.Menu):
             e = payload.emoji
             tag = f"<:{e.name}:{e.id}>"
             react_role = REVERSE_BUTTONS[tag]
-        role_max = self.template[react_role]['amount']
-        already_in_event = payload.user_id in user_ids
 
-        if len(role_list[react_role]) >= role_max:
-            if not already_in_event:
-                react_role = "fill"
+        await self.assign(payload.user_id, react_role, check_conflicts=True)
+
+    def _refuse_overlaps(self, user_id):
+        """Return True if the event overlaps the other events of the
+        user, who is then told why their sign-up was refused.
+        """
+
+        overlaps = self._overlaps(user_id)
+        if overlaps:
+            # the member has to leave the other events first
+            self.bot.loop.create_task(
+                self._warn_conflicts(user_id, overlaps))
+
+        return bool(overlaps)
+
+    def _overlaps(self, user_id):
+        """Return the other events of the user overlapping this one."""
+
+        if self.conflicts is None:
+            return []
+
+        return self.conflicts.overlapping(self.event_id, user_id)
+
+    async def _warn_conflicts(self, user_id, overlaps):
+        """Tell the user why their sign-up was refused."""
+
+        user = self.bot.get_user(user_id)
+        if user is None:
+            return
+
+        events = "\n".join(
+            f"- {event.label}, on {event.start:%Y-%m-%d %H:%M} UTC"
+            for event in overlaps
+        )
+        try:
+            await user.send(
+                f"You were not signed up for {self.template.title}, it "
+                f"overlaps with your other events:\n{events}\n"
+                "Leave them first if you want to join this one.")
+        except discord.HTTPException:
+            pass
+
+    async def assign(self, user_id, role, check_conflicts=False):
+        """Give the role to the user, in order with the other changes
+        of the event. Return True if the roster changed.
+        With check_conflicts, the sign-up of a user not yet registered
+        to the event is refused if it overlaps their other events,
+        unless they end up in the Fill list.
+        """
+
+        self.last_active = time.monotonic()
+        return await self.actor.submit(
+            self._assign, user_id, role, check_conflicts)
+
+    async def unassign(self, user_id):
+        """Remove the user from the event, in order with the other
+        changes of the event. Return True if the roster changed.
+        """
+
+        self.last_active = time.monotonic()
+        return await self.actor.submit(self._unassign, user_id)
+
+    async def _assign(self, user_id, role, check_conflicts=False):
+        if role == "leader":
+            if user_id not in self.roster:
+                # do not let unregistered users in the Leader role
+                return False
+
+            if self.roster.leader is not None:
+                # no more than one Leader
+                return False
 
-            else:
-                # already in a role, the requested one is full,
-                # then do not change the user's role
-                return
+            changed = self._change_participant(user_id, "leader", clear=None)
 
-        await self._remove_event_role(payload.user_id)
-        await self._add_event_role(payload.user_id, react_role)
-        await self.update_page()
+        elif role == "fill":
+            changed = self._change_participant(user_id, "fill", clear="all")
+
+        else:
+            if self.roster.is_full(role):
+                if user_id not in self.roster:
+                    role = "fill"
+
+                else:
+                    # already in a role, the requested one is full,
+                    # then do not change the user's role
+                    return False
+
+            if (check_conflicts and role != "fill"
+                    and user_id not in self.roster
+                    and self._refuse_overlaps(user_id)):
+                return False
+
+            changed = self._change_participant(user_id, role)
+
+        if changed:
+            await self.update_page()
+
+        return changed
+
+    async def _unassign(self, user_id):
+        changed = self._change_participant(user_id, clear="all")
+        if changed:
+            await self.update_page()
+
+        return changed
 
     async def update_page(self):
-        """Rebuild the embed with the new data."""
+        """Schedule the rebuild of the embed with the new data.
+        Updates close to each other are merged into a single edit.
+        """
 
-        participants = await self._get_participants()
-        embed = self.build_embed(participants)
-        await self.message.edit(content=None, embed=embed)
+        if self.updater.request():
+            EMBED_EDITS.inc(event_type=self.event_type, result="coalesced")
+
+    async def _edit_page(self):
+        """Rebuild the embed with the latest data.
+        Return False if the message already shows that embed and the
+        edit was skipped.
+        """
+
+        embed = self.build_embed()
+        embed_hash = self._hash_embed(embed)
+        if embed_hash == self._embed_hash:
+            EMBED_EDITS.inc(event_type=self.event_type, result="skipped")
+            return False
+
+        with REST_SECONDS.time(call="edit", event_type=self.event_type):
+            await self.message.edit(content=None, embed=embed)
+        EMBED_EDITS.inc(event_type=self.event_type, result="sent")
+        self._embed_hash = embed_hash
+        return True
+
+    def _observe_edit(self, delay):
+        EMBED_DELAY_SECONDS.observe(delay, event_type=self.event_type)
+
+    @staticmethod
+    def _hash_embed(embed):
+        """Hash the content of the embed, to compare renders."""
 
-    def build_embed(self, participants=None):
+        return hash(json.dumps(embed.to_dict(), sort_keys=True))
+
+    def build_embed(self):
         """Build the required Embed for the requested event."""
 
-        role_list = self._classify_roles(participants)
+        leader = self.roster.leader
+
+        embed = self._clone_embed(self._embed_skeleton())
+        embed.add_field(
+            name=f"{BUTTONS['leader']} Leader",
+            value=f"<@{leader}>" if leader is not None else None,
+            inline=False,
+        )
+
+        for role in self.template.roles:
+            users = self.roster.users(role)
+            field_name = (
+                f"{self.template.headers[role]} "
+                f"({len(users)}/{self.template.amounts[role]})"
+            )
+            field_value = '\n'.join([f"<@{user_id}>" for user_id in users])
+
+            embed.add_field(
+                name=field_name,
+                value=field_value if field_value else None,
+            )
+
+        fill_field_value = '\n'.join(
+            [f"<@{user_id}>" for user_id in self.roster.fill_queue])
+
+        embed.add_field(
+            name=f"{BUTTONS['fill']} Fill",
+            value=fill_field_value if fill_field_value else None,
+            inline=False,
+        )
+
+        return embed
+
+    def _embed_skeleton(self):
+        """Return the part of the embed that does not change with the
+        participants. It is only built once for the menu.
+        """
+
+        if self._skeleton is not None:
+            return self._skeleton
 
         trigger_at_fmt = self.trigger_at.strftime("%Y-%m-%d %H:%M UTC")
 
-        embed = discord.Embed(
-            title=self.template['title'],
-            description=self.template['description'],
-            url=self.template['url'],
+        self._skeleton = discord.Embed(
+            title=self.template.title,
+            description=self.template.description,
+            url=self.template.url,
             color=EMBED_COLOR,
         ).set_author(
             name=self.bot.user.name,
             icon_url=self.bot.user.avatar_url,
         ).set_image(
-            url=self.template['image'],
+            url=self.template.image,
         ).set_footer(
             text=(
                 f"Event ID {self.event_id:03d} | "
@@ -213,75 +453,89 @@ class RegistrationMenu(menus.Menu):
             ),
         ).add_field(
             name="Guides",
-            value=self.template['guides'],
+            value=self.template.guides,
         ).add_field(
             name="Requirements",
-            value=self.template['requirements'],
-        ).add_field(
-            name=f"{BUTTONS['leader']} Leader",
-            value=f"<@{role_list['leader'][0]}>"
-                  if role_list['leader'] else None,
-            inline=False,
+            value=self.template.requirements,
         )
 
-        for role in ALL_ROLES:
-            if not self._skip_role(role)(self):
-                field_name = (
-                    f"{BUTTONS[role]} "
-                    f"{self.template[role]['name']} "
-                    f"({len(role_list[role])}/{self.template[role]['amount']})"
-                )
-                field_value = '\n'.join(
-                    [f"<@{user_id}>" for user_id in role_list[role]])
-
-                embed.add_field(
-                    name=field_name,
-                    value=field_value if field_value else None,
-                )
+        return self._skeleton
 
-        fill_field_value = '\n'.join(
-            [f"<@{user_id}>" for user_id in role_list['fill']])
+    @staticmethod
+    def _clone_embed(embed):
+        """Cheap copy of the embed, that can receive new fields.
+        Embed.copy() goes through a full to_dict/from_dict round trip.
+        """
 
-        embed.add_field(
-            name=f"{BUTTONS['fill']} Fill",
-            value=fill_field_value if fill_field_value else None,
-            inline=False,
-        )
+        clone = copy.copy(embed)
+        # the fields already there are never modified, only appended to
+        clone._fields = list(embed._fields)
+        return clone
 
-        return embed
+    def set_template(self, template):
+        """Change the template of the event, with the buttons and the
+        reactions of its roles.
+        """
+
+        self.template = template
+        self.roster.amounts = template.amounts
+        self._skeleton = None
+        self._index_event()
+
+        # the buttons are built again from the roles of the template
+        try:
+            del self.buttons
+        except AttributeError:
+            pass
+
+        if self.message is not None:
+            if self._reactions_task is not None:
+                self._reactions_task.cancel()
+            self._reactions_task = self.bot.loop.create_task(
+                self._sync_reactions())
 
-    def _classify_roles(self, participants):
-        """Counts the number of participants in the roles of the event."""
+    def _index_event(self):
+        """Update the interval of the event in the conflict index."""
+
+        if self.conflicts is None or self.message is None:
+            return
+
+        self.conflicts.set_event(
+            self.event_id,
+            self.message.guild.id,
+            utc_naive(self.trigger_at),
+            self.template.duration,
+            f"{self.template.title} (Event ID {self.event_id:03d})",
+        )
 
-        role_list = defaultdict(lambda: [])
-        for user in participants:
-            # classify users in roles
-            role_list[user['role']].append(user['user_id'])
+    def _in_role(self, user_id):
+        """True if the user has a role, other than Leader or Fill."""
 
-        return role_list
+        return not self.roster.roles_of(user_id) <= {"leader", "fill"}
 
+    @db_query
     async def _update_event(self):
         """Update the DB entry with the info from the message
         containing the Menu.
         """
-        await self.bot.db.execute(
-            """
-            UPDATE eventeso_event
-               SET message_id = :message_id,
-                   channel_id = :channel_id,
-                   created_at = :created_at
-             WHERE rowid = :event_id
-            """,
-            {
-                'event_id': self.event_id,
-                'channel_id': self.message.channel.id,
-                'created_at': self.message.created_at,
-                'message_id': self.message.id,
-            }
-        )
-
-        await self.bot.db.commit()
+        async with self.bot.transaction():
+            await self.bot.db.execute(
+                """
+                UPDATE eventeso_event
+                   SET message_id = :message_id,
+                       channel_id = :channel_id,
+                       created_at = :created_at
+                 WHERE event_id = :event_id
+                """,
+                {
+                    'event_id': self.event_id,
+                    'channel_id': self.message.channel.id,
+                    'created_at': self.message.created_at,
+                    'message_id': self.message.id,
+                }
+            )
 
+    @db_query
     async def _get_participants(self):
         """Get the list of participants, and their roles for the event."""
 
@@ -290,6 +544,7 @@ class RegistrationMenu(menus.Menu):
                 SELECT *
                   FROM eventeso_participant
                  WHERE event_id = :event_id
+                 ORDER BY rowid
                 """,
                 {
                     'event_id': self.event_id
@@ -299,59 +554,111 @@ class RegistrationMenu(menus.Menu):
 
         return rows
 
-    async def _add_event_role(self, user_id, role):
-        """Add a role to the user participating to the event."""
-
-        await self.bot.db.execute(
-            """
-            INSERT OR IGNORE INTO eventeso_participant
-            VALUES (:event_id,
-                    :role,
-                    :user_id)
-            """,
-            {
-                'event_id': self.event_id,
-                'role': role,
-                'user_id': user_id,
-            }
-        )
+    def _change_participant(self, user_id, role=None, clear="roles"):
+        """Change the participation of a user to the event as a single
+        operation, written to the DB in one transaction.
+
+        clear can be "roles" to remove the roles of the user except
+        Leader, "all" to remove all of them, or None to keep them.
+        The new role is then added, if any, and kept in place if the
+        user already had it.
+        The slots freed by the change are given to the Fill list, in
+        the same transaction.
+        Return True if the roster changed.
+        """
 
-        await self.bot.db.commit()
-
-    async def _clear_participant(self, user_id):
-        """Entirely remove a participant from the event."""
-
-        await self.bot.db.execute(
-            """
-            DELETE FROM eventeso_participant
-             WHERE user_id = :user_id
-               AND event_id = :event_id
-            """,
-            {
-                'user_id': user_id,
-                'event_id': self.event_id,
-            }
-        )
+        statements, freed = self._participant_statements(
+            user_id, role, clear)
+        if statements:
+            statements.extend(self._promote_fill(freed, user_id))
+            self.writer.enqueue(statements)
 
-        await self.bot.db.commit()
-
-    async def _remove_event_role(self, user_id):
-        """Remove the role of a user from the event."""
-
-        await self.bot.db.execute(
-            """
-            DELETE FROM eventeso_participant
-             WHERE user_id = :user_id
-               AND event_id = :event_id
-               AND role != 'leader'
-            """,
-            {
-                'user_id': user_id,
-                'event_id': self.event_id,
-            }
-        )
+        return bool(statements)
+
+    def _participant_statements(self, user_id, role, clear):
+        """Apply the change of participation to the roster.
+        Return the statements writing it to the DB, and the roles of
+        the event left by the user.
+        """
+
+        statements = []
+        removed = []
+
+        if clear is not None:
+            removed = [
+                r for r in self.roster.roles_of(user_id)
+                if r != role and not (clear == "roles" and r == "leader")
+            ]
+            for r in removed:
+                self.roster.remove(user_id, r)
+                statements.append((
+                    """
+                    DELETE FROM eventeso_participant
+                     WHERE event_id = :event_id
+                       AND role = :role
+                       AND user_id = :user_id
+                    """,
+                    {
+                        'event_id': self.event_id,
+                        'role': r,
+                        'user_id': user_id,
+                    }
+                ))
+
+        if role is not None and self.roster.add(user_id, role):
+            statements.append((
+                """
+                INSERT OR IGNORE INTO eventeso_participant
+                VALUES (:event_id,
+                        :role,
+                        :user_id)
+                """,
+                {
+                    'event_id': self.event_id,
+                    'role': role,
+                    'user_id': user_id,
+                }
+            ))
+
+        if statements and self.conflicts is not None:
+            self.conflicts.set_participant(
+                self.event_id, user_id, self._in_role(user_id))
+
+        freed = [r for r in removed if r not in ("leader", "fill")]
+        return statements, freed
+
+    def _promote_fill(self, roles, leaving_id):
+        """Give the freed roles to the users of the Fill list, in their
+        order of arrival. A user is only promoted to a type of role
+        they accept, if they set their preferences, and if the event
+        does not overlap their other events, as for a sign-up to a
+        role. The user who freed the roles is not promoted back to
+        them.
+        Return the statements writing the promotions to the DB.
+        """
+
+        statements = []
+        for role in roles:
+            if self.roster.is_full(role):
+                continue
+
+            for user_id in self.roster.fill_queue:
+                if user_id != leaving_id and self._accepts(user_id, role):
+                    promoted, _ = self._participant_statements(
+                        user_id, role, clear="roles")
+                    statements.extend(promoted)
+                    break
+
+        return statements
+
+    def _accepts(self, user_id, role):
+        """Return True if the user can be promoted to the role."""
+
+        accepted = self.preferences.get(user_id)
+        if accepted and role_type(role) not in accepted:
+            return False
 
-        await self.bot.db.commit()
+        return not self._overlaps(user_id)
 
 
 class EditMenu(menus.Menu):
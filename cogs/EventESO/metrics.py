@@ -0,0 +1,259 @@
+import bisect
+import functools
+import time
+
+from aiohttp import web
+
+# Upper bounds in seconds of the latency buckets
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+
+    pairs = ",".join(f'{name}="{value}"' for name, value in labels.items())
+    return f"{{{pairs}}}"
+
+
+class Metric:
+    """Base of the metrics, with values kept by label values."""
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key):
+        return dict(zip(self.labelnames, key))
+
+    def _matching(self, labels):
+        """Return the values of the keys matching the given labels,
+        all of them if no label is given.
+        """
+
+        wanted = {
+            i: str(labels[name]) for i, name in enumerate(self.labelnames)
+            if name in labels
+        }
+        return [
+            value for key, value in self._values.items()
+            if all(key[i] == v for i, v in wanted.items())
+        ]
+
+    def samples(self):
+        """Yield the (name, labels, value) of the metric."""
+
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """Value that only goes up, like a number of calls."""
+
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        """Return the sum of the values matching the labels."""
+
+        return sum(self._matching(labels))
+
+    def samples(self):
+        for key, value in self._values.items():
+            yield self.name, self._labels(key), value
+
+
+class Gauge(Metric):
+    """Value read from the state of the Bot when collected.
+    The function returns a dict of label values tuple to value.
+    """
+
+    type = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+
+    def samples(self):
+        for key, value in self.function().items():
+            yield self.name, self._labels(key), value
+
+
+class Histogram(Metric):
+    """Distribution of observed values, counted in buckets."""
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        data = self._values.get(key)
+        if data is None:
+            # counts of each bucket and +Inf, sum
+            data = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+
+        data[0][bisect.bisect_left(self.buckets, value)] += 1
+        data[1] += value
+
+    def time(self, **labels):
+        """Context manager observing the time spent in its block."""
+
+        return _Timer(self, labels)
+
+    def count(self, **labels):
+        """Return the number of values observed matching the labels."""
+
+        return sum(sum(counts) for counts, _ in self._matching(labels))
+
+    def quantile(self, q, **labels):
+        """Estimate the quantile of the values matching the labels, as
+        the upper bound of its bucket. Return None without values.
+        """
+
+        counts = [0] * (len(self.buckets) + 1)
+        for data in self._matching(labels):
+            counts = [a + b for a, b in zip(counts, data[0])]
+
+        total = sum(counts)
+        if not total:
+            return None
+
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            if cumulative >= q * total:
+                return bound
+
+    def samples(self):
+        for key, (counts, total) in self._values.items():
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                yield (f"{self.name}_bucket",
+                       {**labels, "le": bound}, cumulative)
+
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, cumulative
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+class Registry:
+    """Collection of metrics rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        """Add the metric, replacing the one of the same name."""
+
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REACTIONS = REGISTRY.register(Counter(
+    "eventeso_reactions_total",
+    "Reactions dispatched to the registration menus.",
+    ("event_type",),
+))
+REACTION_SECONDS = REGISTRY.register(Histogram(
+    "eventeso_reaction_seconds",
+    "Time from a reaction to the change of the roster.",
+    ("event_type",),
+))
+EMBED_DELAY_SECONDS = REGISTRY.register(Histogram(
+    "eventeso_embed_delay_seconds",
+    "Time from a change of the roster to the edit of the message.",
+    ("event_type",),
+))
+EMBED_EDITS = REGISTRY.register(Counter(
+    "eventeso_embed_edits_total",
+    "Edits of the registration messages, sent, skipped or coalesced.",
+    ("event_type", "result"),
+))
+DB_SECONDS = REGISTRY.register(Histogram(
+    "eventeso_db_seconds",
+    "Time of the DB queries, by event type when about a single event.",
+    ("query", "event_type"),
+))
+REST_SECONDS = REGISTRY.register(Histogram(
+    "eventeso_rest_seconds",
+    "Time of the Discord REST calls, by event type when about a single "
+    "event.",
+    ("call", "event_type"),
+))
+
+
+def db_query(func):
+    """Decorator timing a coroutine function doing DB queries. The
+    methods of an object with an event_type, like a menu, are timed
+    by event type.
+    """
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        event_type = getattr(args[0], "event_type", "") if args else ""
+        with DB_SECONDS.time(query=func.__qualname__, event_type=event_type):
+            return await func(*args, **kwargs)
+
+    return wrapper
+
+
+async def start_server(registry, host, port):
+    """Serve the metrics of the registry on /metrics.
+    Return the runner of the server, to clean it up.
+    """
+
+    async def handle(request):
+        return web.Response(
+            text=registry.render(),
+            headers={"Content-Type": "text/plain; version=0.0.4"},
+        )
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+
+    return runner
@@ -0,0 +1,494 @@
+import logging
+
+log = logging.getLogger(__name__)
+
+MIGRATIONS = []
+
+
+def migration(func):
+    """Register a migration as the next version of the schema.
+    New migrations must only be appended, after the existing ones.
+    """
+
+    MIGRATIONS.append(func)
+    return func
+
+
+async def get_version(db):
+    """Return the schema version of the DB."""
+
+    async with db.execute("PRAGMA user_version") as c:
+        row = await c.fetchone()
+
+    return row[0]
+
+
+async def migrate(db):
+    """Apply the migrations that the DB is missing.
+    The schema version is kept in PRAGMA user_version, and each
+    migration is applied in its own transaction with the version bump.
+    Foreign keys are not enforced while the tables are rebuilt, and
+    are checked once all the migrations are applied.
+    """
+
+    version = await get_version(db)
+    if version >= len(MIGRATIONS):
+        return
+
+    async with db.execute("PRAGMA foreign_keys") as c:
+        foreign_keys = (await c.fetchone())[0]
+
+    await db.execute("PRAGMA foreign_keys = OFF")
+
+    try:
+        for i, func in enumerate(MIGRATIONS[version:], start=version + 1):
+            # the write lock is taken right away, and the version read
+            # again, as another process sharing the DB may be migrating
+            await db.execute("BEGIN IMMEDIATE")
+            if await get_version(db) >= i:
+                await db.rollback()
+                continue
+
+            try:
+                await func(db)
+                # PRAGMA does not accept parameters
+                await db.execute(f"PRAGMA user_version = {i:d}")
+            except Exception:
+                await db.rollback()
+                raise
+
+            await db.commit()
+            log.info("Migrated the DB to version %d (%s).", i, func.__name__)
+
+        async with db.execute("PRAGMA foreign_key_check") as c:
+            violations = await c.fetchall()
+        if violations:
+            log.warning(
+                "%d rows violate a foreign key after the migrations.",
+                len(violations),
+            )
+
+    finally:
+        await db.execute(f"PRAGMA foreign_keys = {foreign_keys:d}")
+
+
+@migration
+async def create_tables(db):
+    """Create the tables, which may already exist in DBs created
+    before the migrations.
+    """
+
+    await db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS eventeso_event(
+            channel_id INTEGER,
+            created_at TIMESTAMP,
+            event_name TEXT      NOT NULL,
+            event_type TEXT      NOT NULL,
+            is_done    INTEGER   NOT NULL,
+            message_id INTEGER,
+            trigger_at TIMESTAMP NOT NULL
+        )
+        """
+    )
+
+    await db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS eventeso_participant(
+            event_id INTEGER NOT NULL,
+            role     TEXT    NOT NULL,
+            user_id  INTEGER NOT NULL,
+            FOREIGN KEY (event_id)
+                REFERENCES eventeso_event (rowid),
+            UNIQUE(event_id, role, user_id)
+        )
+        """
+    )
+
+
+@migration
+async def add_indexes(db):
+    """Index the active events, and the participations of a user."""
+
+    # used to reload the active events
+    await db.execute(
+        """
+        CREATE INDEX IF NOT EXISTS eventeso_event_active
+            ON eventeso_event (is_done, trigger_at)
+        """
+    )
+
+    # covers the lookups by user, the UNIQUE constraint already
+    # covers the lookups by event
+    await db.execute(
+        """
+        CREATE INDEX IF NOT EXISTS eventeso_participant_user
+            ON eventeso_participant (user_id, event_id, role)
+        """
+    )
+
+
+@migration
+async def add_event_id(db):
+    """Make the event ID an explicit primary key, so that it can be
+    referenced by the foreign key of the participants.
+    """
+
+    await db.execute(
+        """
+        CREATE TABLE eventeso_event_new(
+            event_id   INTEGER   PRIMARY KEY,
+            channel_id INTEGER,
+            created_at TIMESTAMP,
+            event_name TEXT      NOT NULL,
+            event_type TEXT      NOT NULL,
+            is_done    INTEGER   NOT NULL,
+            message_id INTEGER,
+            trigger_at TIMESTAMP NOT NULL
+        )
+        """
+    )
+
+    await db.execute(
+        """
+        INSERT INTO eventeso_event_new
+        SELECT rowid, *
+          FROM eventeso_event
+        """
+    )
+
+    await db.execute(
+        """
+        CREATE TABLE eventeso_participant_new(
+            event_id INTEGER NOT NULL,
+            role     TEXT    NOT NULL,
+            user_id  INTEGER NOT NULL,
+            FOREIGN KEY (event_id)
+                REFERENCES eventeso_event (event_id)
+                ON DELETE CASCADE,
+            UNIQUE(event_id, role, user_id)
+        )
+        """
+    )
+
+    await db.execute(
+        """
+        INSERT INTO eventeso_participant_new
+        SELECT *
+          FROM eventeso_participant
+         WHERE event_id IN (SELECT event_id FROM eventeso_event_new)
+        """
+    )
+
+    await db.execute("DROP TABLE eventeso_participant")
+    await db.execute("DROP TABLE eventeso_event")
+    await db.execute(
+        "ALTER TABLE eventeso_event_new RENAME TO eventeso_event")
+    await db.execute(
+        "ALTER TABLE eventeso_participant_new RENAME TO eventeso_participant")
+
+    # the indexes were dropped with the old tables
+    await add_indexes(db)
+
+
+@migration
+async def add_archive(db):
+    """Create the archive tables of the finished events, and the views
+    over both the active and archived data.
+    """
+
+    await db.execute(
+        """
+        CREATE TABLE eventeso_event_archive(
+            event_id   INTEGER   PRIMARY KEY,
+            channel_id INTEGER,
+            created_at TIMESTAMP,
+            event_name TEXT      NOT NULL,
+            event_type TEXT      NOT NULL,
+            is_done    INTEGER   NOT NULL,
+            message_id INTEGER,
+            trigger_at TIMESTAMP NOT NULL
+        )
+        """
+    )
+
+    await db.execute(
+        """
+        CREATE TABLE eventeso_participant_archive(
+            event_id INTEGER NOT NULL,
+            role     TEXT    NOT NULL,
+            user_id  INTEGER NOT NULL,
+            FOREIGN KEY (event_id)
+                REFERENCES eventeso_event_archive (event_id)
+                ON DELETE CASCADE,
+            UNIQUE(event_id, role, user_id)
+        )
+        """
+    )
+
+    await db.execute(
+        """
+        CREATE INDEX eventeso_participant_archive_user
+            ON eventeso_participant_archive (user_id, event_id, role)
+        """
+    )
+
+    await db.execute(
+        """
+        CREATE VIEW eventeso_event_history AS
+        SELECT * FROM eventeso_event
+         UNION ALL
+        SELECT * FROM eventeso_event_archive
+        """
+    )
+
+    await db.execute(
+        """
+        CREATE VIEW eventeso_participant_history AS
+        SELECT * FROM eventeso_participant
+         UNION ALL
+        SELECT * FROM eventeso_participant_archive
+        """
+    )
+
+
+@migration
+async def add_schedules(db):
+    """Create the table of the recurring events, whose instances are
+    created as they come.
+    """
+
+    await db.execute(
+        """
+        CREATE TABLE eventeso_schedule(
+            schedule_id   INTEGER   PRIMARY KEY,
+            channel_id    INTEGER   NOT NULL,
+            event_name    TEXT      NOT NULL,
+            event_type    TEXT      NOT NULL,
+            first_at      TIMESTAMP NOT NULL,
+            interval_days INTEGER   NOT NULL,
+            occurrences   INTEGER   NOT NULL,
+            created       INTEGER   NOT NULL DEFAULT 0
+        )
+        """
+    )
+
+
+@migration
+async def add_guilds(db):
+    """Add the guild of the events and schedules, and the tables of the
+    settings of each guild.
+    """
+
+    # the archive keeps the same columns, for the views over both
+    for table in ("eventeso_event", "eventeso_event_archive",
+                  "eventeso_schedule"):
+        await db.execute(f"ALTER TABLE {table} ADD COLUMN guild_id INTEGER")
+
+    await db.execute(
+        """
+        CREATE INDEX eventeso_event_guild
+            ON eventeso_event (guild_id, is_done, trigger_at)
+        """
+    )
+
+    await db.execute(
+        """
+        CREATE TABLE eventeso_guild(
+            guild_id  INTEGER PRIMARY KEY,
+            lead_time INTEGER NOT NULL
+        )
+        """
+    )
+
+    await db.execute(
+        """
+        CREATE TABLE eventeso_guild_admin_role(
+            guild_id INTEGER NOT NULL,
+            role_id  INTEGER NOT NULL,
+            FOREIGN KEY (guild_id)
+                REFERENCES eventeso_guild (guild_id)
+                ON DELETE CASCADE,
+            PRIMARY KEY (guild_id, role_id)
+        )
+        """
+    )
+
+
+@migration
+async def add_lease(db):
+    """Create the table of the leases, electing one process among the
+    ones sharing the DB.
+    """
+
+    await db.execute(
+        """
+        CREATE TABLE eventeso_lease(
+            name       TEXT PRIMARY KEY,
+            holder     TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+        """
+    )
+
+
+@migration
+async def add_stats(db):
+    """Create the aggregate tables of the attendance to the events,
+    and fill them from the history.
+    """
+
+    await db.execute(
+        """
+        CREATE TABLE eventeso_stats_user(
+            guild_id INTEGER   NOT NULL,
+            user_id  INTEGER   NOT NULL,
+            events   INTEGER   NOT NULL,
+            led      INTEGER   NOT NULL,
+            filled   INTEGER   NOT NULL,
+            last_at  TIMESTAMP NOT NULL,
+            PRIMARY KEY (guild_id, user_id)
+        )
+        """
+    )
+
+    # used by the leaderboard
+    await db.execute(
+        """
+        CREATE INDEX eventeso_stats_user_events
+            ON eventeso_stats_user (guild_id, events)
+        """
+    )
+
+    await db.execute(
+        """
+        CREATE TABLE eventeso_stats_role(
+            guild_id INTEGER NOT NULL,
+            user_id  INTEGER NOT NULL,
+            role     TEXT    NOT NULL,
+            count    INTEGER NOT NULL,
+            PRIMARY KEY (guild_id, user_id, role)
+        )
+        """
+    )
+
+    await db.execute(
+        """
+        CREATE TABLE eventeso_stats_event(
+            guild_id     INTEGER NOT NULL,
+            event_type   TEXT    NOT NULL,
+            event_name   TEXT    NOT NULL,
+            events       INTEGER NOT NULL,
+            participants INTEGER NOT NULL,
+            PRIMARY KEY (guild_id, event_type, event_name)
+        )
+        """
+    )
+
+    await db.execute(
+        """
+        CREATE TABLE eventeso_stats_week(
+            guild_id     INTEGER NOT NULL,
+            week         TEXT    NOT NULL,
+            events       INTEGER NOT NULL,
+            participants INTEGER NOT NULL,
+            PRIMARY KEY (guild_id, week)
+        )
+        """
+    )
+
+    # the aggregates of the finished events, as of this version, in
+    # one pass over the history
+    await db.execute(
+        """
+        INSERT INTO eventeso_stats_user (guild_id,
+                                         user_id,
+                                         events,
+                                         led,
+                                         filled,
+                                         last_at)
+        SELECT guild_id, user_id, COUNT(*), SUM(led), SUM(filled),
+               MAX(trigger_at)
+          FROM (SELECT e.guild_id,
+                       p.user_id,
+                       MAX(p.role = 'leader') AS led,
+                       MAX(p.role = 'fill') AS filled,
+                       e.trigger_at
+                  FROM eventeso_participant_history AS p
+                  JOIN eventeso_event_history AS e
+                    ON e.event_id = p.event_id
+                 WHERE e.is_done = 1
+                   AND e.guild_id IS NOT NULL
+                 GROUP BY e.event_id, p.user_id)
+         GROUP BY guild_id, user_id
+        """
+    )
+
+    await db.execute(
+        """
+        INSERT INTO eventeso_stats_role (guild_id, user_id, role, count)
+        SELECT e.guild_id, p.user_id, p.role, COUNT(*)
+          FROM eventeso_participant_history AS p
+          JOIN eventeso_event_history AS e
+            ON e.event_id = p.event_id
+         WHERE e.is_done = 1
+           AND e.guild_id IS NOT NULL
+         GROUP BY e.guild_id, p.user_id, p.role
+        """
+    )
+
+    await db.execute(
+        """
+        INSERT INTO eventeso_stats_event (guild_id,
+                                          event_type,
+                                          event_name,
+                                          events,
+                                          participants)
+        SELECT guild_id, event_type, event_name, COUNT(*), SUM(participants)
+          FROM (SELECT e.guild_id,
+                       e.event_type,
+                       e.event_name,
+                       (SELECT COUNT(DISTINCT user_id)
+                          FROM eventeso_participant_history
+                         WHERE event_id = e.event_id) AS participants
+                  FROM eventeso_event_history AS e
+                 WHERE e.is_done = 1
+                   AND e.guild_id IS NOT NULL)
+         GROUP BY guild_id, event_type, event_name
+        """
+    )
+
+    # per week, starting on Monday
+    await db.execute(
+        """
+        INSERT INTO eventeso_stats_week (guild_id, week, events, participants)
+        SELECT guild_id, week, COUNT(*), SUM(participants)
+          FROM (SELECT e.guild_id,
+                       date(e.trigger_at, 'weekday 0', '-6 days') AS week,
+                       (SELECT COUNT(DISTINCT user_id)
+                          FROM eventeso_participant_history
+                         WHERE event_id = e.event_id) AS participants
+                  FROM eventeso_event_history AS e
+                 WHERE e.is_done = 1
+                   AND e.guild_id IS NOT NULL)
+         GROUP BY guild_id, week
+        """
+    )
+
+
+@migration
+async def add_preferences(db):
+    """Create the table of the types of role each member of a guild
+    accepts when promoted from the Fill list.
+    """
+
+    await db.execute(
+        """
+        CREATE TABLE eventeso_role_preference(
+            guild_id  INTEGER NOT NULL,
+            user_id   INTEGER NOT NULL,
+            role_type TEXT    NOT NULL,
+            PRIMARY KEY (guild_id, user_id, role_type)
+        )
+        """
+    )
@@ -0,0 +1,245 @@
+from datetime import timedelta
+import itertools
+import json
+import logging
+import os
+from types import MappingProxyType
+
+log = logging.getLogger(__name__)
+
+ROLE_TYPES = ("dps", "healer", "tank")
+
+ALL_ROLES = [f"{role}{i}" for role, i in
+             itertools.product(ROLE_TYPES, range(4))]
+
+TEXT_FIELDS = (
+    "title",
+    "description",
+    "url",
+    "image",
+    "guides",
+    "requirements",
+)
+
+TEMPLATE_FILES = {
+    "arena": "arenas.json",
+    "dungeon": "dungeons.json",
+    "trial": "trials.json",
+}
+
+# Names of the types of event accepted by the commands
+EVENT_TYPE_NAMES = {
+    name: event_type
+    for event_type in TEMPLATE_FILES
+    for name in (event_type, f"{event_type}s")
+}
+
+# Estimated duration in minutes of the events of each type, for the
+# templates without a duration field
+DEFAULT_DURATIONS = {
+    "arena": 60,
+    "dungeon": 45,
+    "trial": 120,
+}
+
+
+class TemplateError(ValueError):
+    """Exception raised when an event template is not valid."""
+
+
+class EventTemplate:
+    """Parsed and validated template of an event.
+
+    Only the roles with a non-zero amount are kept, in the order of
+    ALL_ROLES, along with the header of their embed field. The
+    estimated duration of the event is given in minutes.
+    """
+
+    __slots__ = (
+        "event_type",
+        "key",
+        "title",
+        "description",
+        "url",
+        "image",
+        "guides",
+        "requirements",
+        "duration",
+        "roles",
+        "names",
+        "amounts",
+        "headers",
+    )
+
+    def __init__(self, event_type, key, data, buttons):
+        self.event_type = event_type
+        self.key = key
+
+        unknown = (data.keys() - set(TEXT_FIELDS) - set(ALL_ROLES)
+                   - {"duration"})
+        if unknown:
+            raise TemplateError(
+                f"{event_type} {key}: unknown fields {sorted(unknown)}.")
+
+        for field in TEXT_FIELDS:
+            value = data.get(field)
+            if not isinstance(value, str):
+                raise TemplateError(
+                    f"{event_type} {key}: missing text field {field}.")
+            setattr(self, field, value)
+
+        duration = data.get("duration", DEFAULT_DURATIONS[event_type])
+        if not isinstance(duration, int) or duration <= 0:
+            raise TemplateError(f"{event_type} {key}: invalid duration.")
+        self.duration = timedelta(minutes=duration)
+
+        names = {}
+        amounts = {}
+        for role in ALL_ROLES:
+            if role not in data:
+                continue
+
+            name = data[role].get("name")
+            amount = data[role].get("amount", 0)
+            if not isinstance(amount, int) or amount < 0:
+                raise TemplateError(
+                    f"{event_type} {key}: invalid amount for {role}.")
+            if amount == 0:
+                continue
+            if not isinstance(name, str):
+                raise TemplateError(
+                    f"{event_type} {key}: missing name for {role}.")
+
+            names[role] = name
+            amounts[role] = amount
+
+        if not amounts:
+            raise TemplateError(f"{event_type} {key}: no roles.")
+
+        self.roles = tuple(names)
+        self.names = MappingProxyType(names)
+        self.amounts = MappingProxyType(amounts)
+        self.headers = MappingProxyType(
+            {role: f"{buttons[role]} {name}" for role, name in names.items()})
+
+    def __setattr__(self, name, value):
+        if hasattr(self, name):
+            raise AttributeError(f"{name} is read-only.")
+        super().__setattr__(name, value)
+
+    def __repr__(self):
+        return f"<EventTemplate {self.event_type} {self.key}>"
+
+    def amount(self, role):
+        """Return the maximum number of participants for the role."""
+
+        return self.amounts.get(role, 0)
+
+
+def role_type(role):
+    """Return the type of the role, e.g. tank for tank1."""
+
+    return role.rstrip("0123456789")
+
+
+def parse_event_type(name):
+    """Return the type of event of its name, e.g. trial for Trials.
+    Raise ValueError if it is not known.
+    """
+
+    try:
+        return EVENT_TYPE_NAMES[name.lower()]
+    except KeyError:
+        raise ValueError(f"No known event type {name}.")
+
+
+def _reject_duplicates(pairs):
+    """JSON hook to refuse objects with duplicated keys."""
+
+    keys = [key for key, value in pairs]
+    duplicates = {key for key in keys if keys.count(key) > 1}
+    if duplicates:
+        raise TemplateError(f"Duplicated keys {sorted(duplicates)}.")
+
+    return dict(pairs)
+
+
+class TemplateRegistry:
+    """Registry of the event templates, loaded from the JSON files.
+
+    Each file is parsed and validated once, and parsed again when
+    it changes on disk. An invalid file is refused and its previous
+    templates are kept.
+    """
+
+    def __init__(self, path, buttons):
+        self.path = path
+        self.buttons = buttons
+        self._templates = {}
+        self._mtimes = {}
+
+        for event_type in TEMPLATE_FILES:
+            self._load(event_type)
+
+    def get(self, event_type, key):
+        """Return the template of the event."""
+
+        return self.templates(event_type)[key]
+
+    def templates(self, event_type):
+        """Return the templates of that type of event, by key."""
+
+        try:
+            return self._templates[event_type]
+        except KeyError:
+            raise ValueError(f"No known event type {event_type}.")
+
+    def reload_if_changed(self):
+        """Reload the files that changed on disk.
+        Return the types of event that were reloaded.
+        """
+
+        reloaded = []
+        for event_type in TEMPLATE_FILES:
+            try:
+                mtime = os.stat(self._file(event_type)).st_mtime_ns
+            except OSError as e:
+                # e.g. the file was removed, its templates are kept and
+                # it is reloaded once it is back
+                if self._mtimes[event_type] is not None:
+                    self._mtimes[event_type] = None
+                    log.error("Could not reload the %s templates: %s",
+                              event_type, e)
+                continue
+
+            if mtime == self._mtimes[event_type]:
+                continue
+
+            try:
+                self._load(event_type)
+            except (OSError, ValueError) as e:
+                # do not retry until the file changes again
+                self._mtimes[event_type] = mtime
+                log.error("Could not reload the %s templates: %s",
+                          event_type, e)
+            else:
+                reloaded.append(event_type)
+
+        return reloaded
+
+    def _file(self, event_type):
+        return os.path.join(self.path, TEMPLATE_FILES[event_type])
+
+    def _load(self, event_type):
+        filename = self._file(event_type)
+        mtime = os.stat(filename).st_mtime_ns
+        with open(filename) as f:
+            data = json.load(f, object_pairs_hook=_reject_duplicates)
+
+        templates = {
+            key: EventTemplate(event_type, key, value, self.buttons)
+            for key, value in data.items()
+        }
+
+        self._templates[event_type] = MappingProxyType(templates)
+        self._mtimes[event_type] = mtime
@@ -0,0 +1,120 @@
+class Roster:
+    """Participants of an event and their roles.
+
+    Keeps the roles of each user, and the users of each role in order
+    of arrival, so that lookups, counts and updates are all O(1). A
+    user can hold the Leader role on top of another one, and there can
+    only be one Leader.
+    """
+
+    def __init__(self, amounts):
+        self.amounts = amounts
+        self._roles = {}  # user_id: set of roles
+        self._users = {}  # role: dict of user_id, ordered by arrival
+
+    @classmethod
+    def from_rows(cls, amounts, rows):
+        """Build the roster from the eventeso_participant rows."""
+
+        roster = cls(amounts)
+        for row in rows:
+            roster.add(row['user_id'], row['role'])
+
+        return roster
+
+    def __contains__(self, user_id):
+        return user_id in self._roles
+
+    def __len__(self):
+        return len(self._roles)
+
+    def __iter__(self):
+        """Iterate over the (role, user_id) pairs of the roster."""
+
+        for role, users in self._users.items():
+            for user_id in users:
+                yield role, user_id
+
+    @property
+    def leader(self):
+        """The user ID of the Leader, or None."""
+
+        return next(iter(self._users.get("leader", ())), None)
+
+    @property
+    def fill_queue(self):
+        """The user IDs in the Fill role, in order of arrival."""
+
+        return self.users("fill")
+
+    def user_ids(self):
+        """Return the IDs of all the participants."""
+
+        return list(self._roles)
+
+    def roles_of(self, user_id):
+        """Return the roles of the user."""
+
+        return frozenset(self._roles.get(user_id, ()))
+
+    def users(self, role):
+        """Return the user IDs in the role, in order of arrival."""
+
+        return list(self._users.get(role, ()))
+
+    def count(self, role):
+        """Return the number of users in the role."""
+
+        return len(self._users.get(role, ()))
+
+    def capacity(self, role):
+        """Return the maximum number of users in the role, or None if
+        it is not limited.
+        """
+
+        if role == "leader":
+            return 1
+
+        if role == "fill":
+            return None
+
+        return self.amounts.get(role, 0)
+
+    def is_full(self, role):
+        """Return True if the role cannot take more users."""
+
+        capacity = self.capacity(role)
+        return capacity is not None and self.count(role) >= capacity
+
+    def add(self, user_id, role):
+        """Add the role to the user.
+        Return False if the user already had it, or if the role is
+        Leader and someone else already holds it.
+        """
+
+        users = self._users.setdefault(role, {})
+        if user_id in users:
+            return False
+
+        if role == "leader" and users:
+            return False
+
+        users[user_id] = None
+        self._roles.setdefault(user_id, set()).add(role)
+        return True
+
+    def remove(self, user_id, role):
+        """Remove the role from the user.
+        Return False if the user did not have it.
+        """
+
+        roles = self._roles.get(user_id)
+        if roles is None or role not in roles:
+            return False
+
+        roles.discard(role)
+        if not roles:
+            del self._roles[user_id]
+
+        del self._users[role][user_id]
+        return True
@@ -0,0 +1,127 @@
+import asyncio
+from datetime import datetime, timezone
+import heapq
+import itertools
+import logging
+
+log = logging.getLogger(__name__)
+
+
+def utc_naive(dt):
+    """Return the datetime as a naive datetime in UTC."""
+
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+
+    return dt
+
+
+class EventScheduler:
+    """Single timer owning the trigger times of all the events.
+
+    The trigger times are kept in a heap, and only one task sleeps
+    until the earliest of them. Cancelled entries are only marked as
+    removed and dropped when they reach the top of the heap.
+    """
+
+    def __init__(self, loop, callback):
+        self.loop = loop
+        self.callback = callback
+
+        self._heap = []
+        self._entries = {}
+        self._counter = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    @property
+    def next_due(self):
+        """The time of the next trigger, or None if nothing is pending."""
+
+        self._prune()
+        if self._heap:
+            return self._heap[0][0]
+
+        return None
+
+    def start(self):
+        """Start the scheduling task."""
+
+        if self._task is None or self._task.done():
+            self._task = self.loop.create_task(self._run())
+
+    def stop(self):
+        """Stop the scheduling task. The entries are kept."""
+
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def schedule(self, key, when, callback=None):
+        """Schedule the callback to be called with key at the given
+        time, replacing the previous entry for that key. The callback
+        defaults to the one of the scheduler.
+        """
+
+        self.cancel(key)
+        entry = [
+            utc_naive(when),
+            next(self._counter),
+            key,
+            callback or self.callback,
+            True,
+        ]
+        self._entries[key] = entry
+        heapq.heappush(self._heap, entry)
+
+        if self._heap[0] is entry:
+            self._wakeup.set()
+
+    def cancel(self, key):
+        """Remove the entry for that key, if any."""
+
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            entry[-1] = False
+
+            # do not let the heap fill up with cancelled entries
+            if len(self._heap) > 2 * len(self._entries) + 16:
+                self._heap = [e for e in self._heap if e[-1]]
+                heapq.heapify(self._heap)
+
+    def _prune(self):
+        while self._heap and not self._heap[0][-1]:
+            heapq.heappop(self._heap)
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            when = self.next_due
+
+            if when is None:
+                await self._wakeup.wait()
+                continue
+
+            delay = (when - datetime.utcnow()).total_seconds()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            entry = heapq.heappop(self._heap)
+            del self._entries[entry[2]]
+            self.loop.create_task(self._call(entry[3], entry[2]))
+
+    async def _call(self, callback, key):
+        try:
+            await callback(key)
+        except Exception:
+            log.exception("Error while triggering %r.", key)
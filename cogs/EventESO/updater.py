@@ -0,0 +1,90 @@
+import asyncio
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class EmbedUpdater:
+    """Coalesce the updates of a menu's message.
+
+    Updates requested while another one is already waiting are merged
+    with it, and the message is edited at most once per interval. The
+    edit always renders the latest state of the menu, so the last
+    update is never lost. The edit callback returns False when it
+    skipped the edit because the message was already up to date.
+    A failed edit is tried once more after the interval.
+    The optional observe callback receives the delay in seconds between
+    the first request and the end of the edit that applied it.
+    """
+
+    def __init__(self, edit, interval, observe=None):
+        self.edit = edit
+        self.interval = interval
+        self.observe = observe
+
+        self.requested = 0
+        self.sent = 0
+        self.coalesced = 0
+        self.skipped = 0
+
+        self._dirty = False
+        self._requested_at = None
+        self._last_edit = None
+        self._task = None
+
+    def request(self):
+        """Ask for the message to be edited.
+        Return True if the request was merged with a pending one.
+        """
+
+        self.requested += 1
+        if self._dirty:
+            self.coalesced += 1
+            return True
+
+        self._dirty = True
+        self._requested_at = asyncio.get_event_loop().time()
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_event_loop().create_task(self._run())
+
+        return False
+
+    async def flush(self):
+        """Wait for the pending update to be sent, if any."""
+
+        if self._task is not None:
+            await self._task
+
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+        retried = False
+        while self._dirty:
+            if self._last_edit is not None:
+                delay = self._last_edit + self.interval - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+            self._dirty = False
+            requested_at = self._requested_at
+            try:
+                edited = await self.edit()
+            except Exception:
+                log.exception("Could not update the menu message.")
+                if not retried:
+                    # otherwise the message shows a stale roster until
+                    # the next change
+                    retried = True
+                    self._dirty = True
+                    self._last_edit = loop.time()
+                continue
+
+            retried = False
+
+            if self.observe is not None:
+                self.observe(loop.time() - requested_at)
+
+            if edited:
+                self._last_edit = loop.time()
+                self.sent += 1
+            else:
+                self.skipped += 1
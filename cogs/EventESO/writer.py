@@ -0,0 +1,114 @@
+import asyncio
+import logging
+
+import aiosqlite
+
+from .metrics import db_query
+
+log = logging.getLogger(__name__)
+
+# Delays in seconds before flushing again after a failed flush, doubled
+# on each failure in a row
+RETRY_DELAY = 1.0
+RETRY_DELAY_MAX = 60.0
+
+
+class ParticipantWriter:
+    """Write-behind queue for the participant changes of the menus.
+
+    The menus keep their roster in memory and only enqueue the
+    matching changes here. A change is a list of SQL statements that
+    are applied together. They are flushed to the DB in the background,
+    in a single transaction for everything that piled up since the
+    last flush, each change in its own savepoint. A change refused by
+    the constraints of the DB is dropped, and the changes of a flush
+    that failed otherwise, e.g. with the DB locked, are flushed again
+    later.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._pending = []
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task = None
+
+    def start(self):
+        """Start the background flushing task."""
+
+        if self._task is None or self._task.done():
+            self._task = self.bot.loop.create_task(self._run())
+
+    def stop(self):
+        """Stop the background task.
+        Return the flush of what is left, to be awaited.
+        """
+
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+        return self.flush()
+
+    def enqueue(self, statements):
+        """Queue a change to be executed on the next flush."""
+
+        self._pending.append(statements)
+        self._wakeup.set()
+
+    @db_query
+    async def flush(self):
+        """Execute all the queued changes and commit them."""
+
+        async with self._lock:
+            pending, self._pending = self._pending, []
+            if not pending:
+                return
+
+            dropped = set()
+            try:
+                async with self.bot.transaction() as db:
+                    for statements in pending:
+                        if not await self._execute(db, statements):
+                            dropped.add(id(statements))
+            except BaseException:
+                # before the changes queued since, to keep their order
+                self._pending[:0] = [
+                    s for s in pending if id(s) not in dropped]
+                raise
+
+    async def _execute(self, db, statements):
+        """Execute the statements of a change in a savepoint.
+        Return False if the change was refused and rolled back.
+        """
+
+        await db.execute("SAVEPOINT participant")
+        try:
+            for query, params in statements:
+                await db.execute(query, params)
+        except aiosqlite.IntegrityError:
+            # e.g. the event was deleted, retrying would fail again
+            await db.execute("ROLLBACK TO participant")
+            await db.execute("RELEASE participant")
+            log.exception("Dropped a participant change: %r", statements)
+            return False
+
+        await db.execute("RELEASE participant")
+        return True
+
+    async def _run(self):
+        delay = RETRY_DELAY
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                log.exception(
+                    "Could not flush the participant changes, "
+                    "retrying in %.1f s.", delay)
+                await asyncio.sleep(delay)
+                delay = min(2 * delay, RETRY_DELAY_MAX)
+                self._wakeup.set()
+            else:
+                delay = RETRY_DELAY
@@ -0,0 +1,80 @@
+"""Helpers shared by the tests."""
+
+import os
+import tempfile
+import unittest
+
+import aiosqlite
+import discord
+
+from FateBot import FateBot
+from cogs.EventESO import migrations
+
+
+class DBTestCase(unittest.IsolatedAsyncioTestCase):
+    """Test case with a bot connected to a new DB file, migrated to the
+    latest schema. The bot does not connect to Discord.
+    """
+
+    migrate = True
+
+    async def asyncSetUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.db_name = os.path.join(self._tmp.name, "test.db")
+        self.bot = FateBot(
+            command_prefix="&",
+            intents=discord.Intents.none(),
+            db_name=self.db_name,
+        )
+        await self.bot._open_db()
+        if self.migrate:
+            await migrations.migrate(self.bot.db)
+
+    async def asyncTearDown(self):
+        await self.bot.db.close()
+        self._tmp.cleanup()
+
+    async def connect(self, **kwargs):
+        """Return another connection to the DB, closed after the test."""
+
+        db = await aiosqlite.connect(self.db_name, **kwargs)
+        self.addAsyncCleanup(db.close)
+        return db
+
+    async def create_event(self, event_type="dungeon", event_name="randnorm",
+                           trigger_at="2030-01-01 20:00:00"):
+        """Insert an event and return its ID."""
+
+        async with self.bot.db.execute(
+                """
+                INSERT INTO eventeso_event (event_name,
+                                            event_type,
+                                            is_done,
+                                            trigger_at,
+                                            guild_id)
+                VALUES (:event_name, :event_type, 0, :trigger_at, 1)
+                """,
+                {
+                    'event_name': event_name,
+                    'event_type': event_type,
+                    'trigger_at': trigger_at,
+                }
+        ) as c:
+            event_id = c.lastrowid
+        await self.bot.db.commit()
+
+        return event_id
+
+    async def participants(self, event_id):
+        """Return the (role, user_id) rows of the event, by role."""
+
+        async with self.bot.db.execute(
+                """
+                SELECT role, user_id
+                  FROM eventeso_participant
+                 WHERE event_id = :event_id
+                 ORDER BY role, user_id
+                """,
+                {'event_id': event_id}
+        ) as c:
+            return [tuple(row) for row in await c.fetchall()]
@@ -0,0 +1,77 @@
+import unittest
+
+from .common import DBTestCase
+
+
+class Refused(Exception):
+    pass
+
+
+class TransactionTest(DBTestCase):
+
+    async def insert(self, db, user_id):
+        await db.execute(
+            """
+            INSERT INTO eventeso_participant
+            VALUES (:event_id,
+                    'dps0',
+                    :user_id)
+            """,
+            {'event_id': self.event_id, 'user_id': user_id}
+        )
+
+    async def committed(self):
+        """Return the user IDs of the participants committed to the DB."""
+
+        other = await self.connect()
+        async with other.execute(
+                "SELECT user_id FROM eventeso_participant ORDER BY user_id"
+        ) as c:
+            return [row[0] for row in await c.fetchall()]
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.event_id = await self.create_event()
+
+    async def test_commit(self):
+        async with self.bot.transaction() as db:
+            await self.insert(db, 1)
+            await self.insert(db, 2)
+
+        self.assertFalse(self.bot.db.in_transaction)
+        self.assertEqual(await self.committed(), [1, 2])
+
+    async def test_error_ends_the_transaction(self):
+        with self.assertRaises(Refused):
+            async with self.bot.transaction() as db:
+                await self.insert(db, 1)
+                raise Refused
+
+        self.assertFalse(self.bot.db.in_transaction)
+        self.assertEqual(await self.participants(self.event_id), [])
+
+        # the write lock of the DB is released
+        other = await self.connect(isolation_level=None, timeout=0)
+        await other.execute("BEGIN IMMEDIATE")
+        await other.execute("ROLLBACK")
+
+    async def test_error_keeps_the_other_changes(self):
+        # a change not committed yet, e.g. waiting for the group commit
+        await self.insert(self.bot.db, 1)
+        self.assertTrue(self.bot.db.in_transaction)
+
+        with self.assertRaises(Refused):
+            async with self.bot.transaction() as db:
+                await self.insert(db, 2)
+                raise Refused
+
+        self.assertTrue(self.bot.db.in_transaction)
+        self.assertEqual(
+            await self.participants(self.event_id), [("dps0", 1)])
+
+        await self.bot.commit()
+        self.assertEqual(await self.committed(), [1])
+
+
+if __name__ == "__main__":
+    unittest.main()
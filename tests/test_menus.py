@@ -0,0 +1,112 @@
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+import unittest
+
+from cogs.EventESO.conflicts import ConflictIndex
+from cogs.EventESO.menus import RegistrationMenu
+
+TRIGGER_AT = datetime(2030, 1, 1, 20)
+
+
+class RegistrationRulesTest(unittest.IsolatedAsyncioTestCase):
+    """Sign-up and promotion rules of the menus, on a Random Normal
+    dungeon: 2 DPS, 1 Healer and 1 Tank.
+    """
+
+    async def asyncSetUp(self):
+        self.conflicts = ConflictIndex()
+        self.preferences = {}
+        self.changes = []
+        self.bot = SimpleNamespace(
+            loop=asyncio.get_running_loop(),
+            get_user=lambda user_id: None,
+        )
+
+    def create_menu(self, event_id, trigger_at=TRIGGER_AT):
+        """Return the menu of a running event, without its message."""
+
+        menu = RegistrationMenu(
+            event_data={
+                'event_id': event_id,
+                'event_name': "randnorm",
+                'event_type': "dungeon",
+                'trigger_at': trigger_at,
+            },
+            bot=self.bot,
+            writer=SimpleNamespace(enqueue=self.changes.append),
+            conflicts=self.conflicts,
+            preferences=self.preferences,
+        )
+        menu.message = SimpleNamespace(guild=SimpleNamespace(id=1))
+        # no message to edit
+        menu.updater.request = lambda: False
+        menu._index_event()
+
+        return menu
+
+    async def test_overlapping_signup_is_refused(self):
+        first = self.create_menu(1)
+        second = self.create_menu(2, TRIGGER_AT + timedelta(minutes=30))
+        self.assertTrue(await first._assign(10, "dps0", check_conflicts=True))
+
+        self.assertFalse(
+            await second._assign(10, "tank0", check_conflicts=True))
+        self.assertNotIn(10, second.roster)
+
+        # the Fill list does not take part in the event
+        self.assertTrue(
+            await second._assign(10, "fill", check_conflicts=True))
+
+    async def test_signup_after_the_event_is_accepted(self):
+        first = self.create_menu(1)
+        second = self.create_menu(2, TRIGGER_AT + timedelta(days=1))
+        await first._assign(10, "dps0", check_conflicts=True)
+
+        self.assertTrue(
+            await second._assign(10, "dps0", check_conflicts=True))
+
+    async def test_change_of_role_is_not_checked(self):
+        first = self.create_menu(1)
+        second = self.create_menu(2)
+        await second._assign(10, "dps0")
+        await first._assign(10, "dps0")
+
+        self.assertTrue(
+            await second._assign(10, "tank0", check_conflicts=True))
+        self.assertEqual(second.roster.roles_of(10), {"tank0"})
+
+    async def test_promotion_in_order_of_arrival(self):
+        menu = self.create_menu(1)
+        for user_id in (10, 11, 12, 13):
+            await menu._assign(user_id, "dps0")
+        self.assertEqual(menu.roster.fill_queue, [12, 13])
+
+        await menu._unassign(10)
+        self.assertEqual(menu.roster.roles_of(12), {"dps0"})
+        self.assertEqual(menu.roster.fill_queue, [13])
+
+    async def test_promotion_skips_overlapping_members(self):
+        other = self.create_menu(1)
+        menu = self.create_menu(2)
+        for user_id in (10, 11, 12, 13):
+            await menu._assign(user_id, "dps0")
+        await other._assign(12, "tank0")
+
+        await menu._unassign(10)
+        self.assertEqual(menu.roster.roles_of(12), {"fill"})
+        self.assertEqual(menu.roster.roles_of(13), {"dps0"})
+
+    async def test_promotion_follows_preferences(self):
+        self.preferences[12] = {"tank"}
+        menu = self.create_menu(1)
+        for user_id in (10, 11, 12, 13):
+            await menu._assign(user_id, "dps0")
+
+        await menu._unassign(10)
+        self.assertEqual(menu.roster.roles_of(12), {"fill"})
+        self.assertEqual(menu.roster.roles_of(13), {"dps0"})
+
+
+if __name__ == "__main__":
+    unittest.main()
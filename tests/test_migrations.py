@@ -0,0 +1,147 @@
+import random
+import unittest
+
+from cogs.EventESO import attendance, migrations
+
+from .common import DBTestCase
+
+# Schema of the DBs created before the migrations
+BASELINE_SCHEMA = """
+CREATE TABLE eventeso_event(
+    channel_id INTEGER,
+    created_at TIMESTAMP,
+    event_name TEXT      NOT NULL,
+    event_type TEXT      NOT NULL,
+    is_done    INTEGER   NOT NULL,
+    message_id INTEGER,
+    trigger_at TIMESTAMP NOT NULL
+);
+CREATE TABLE eventeso_participant(
+    event_id INTEGER NOT NULL,
+    role     TEXT    NOT NULL,
+    user_id  INTEGER NOT NULL,
+    FOREIGN KEY (event_id)
+        REFERENCES eventeso_event (rowid),
+    UNIQUE(event_id, role, user_id)
+);
+"""
+
+
+class MigrationTest(DBTestCase):
+
+    migrate = False
+
+    async def rows(self, query):
+        async with self.bot.db.execute(query) as c:
+            return [tuple(row) for row in await c.fetchall()]
+
+    async def test_migrate_baseline(self):
+        # the foreign key of the baseline was never enforced
+        await self.bot.db.execute("PRAGMA foreign_keys = OFF")
+        await self.bot.db.executescript(BASELINE_SCHEMA)
+        await self.bot.db.executemany(
+            """
+            INSERT INTO eventeso_event
+            VALUES (10, '2021-01-01 10:00:00', :name, 'trial', :done, 20,
+                    '2021-02-01 20:00:00')
+            """,
+            [{'name': "vAS", 'done': 1}, {'name': "vCR", 'done': 0}]
+        )
+        await self.bot.db.executemany(
+            "INSERT INTO eventeso_participant VALUES (?, ?, ?)",
+            [(1, "leader", 100), (1, "dps0", 100), (2, "tank0", 101),
+             # the event of this one was deleted
+             (3, "dps0", 102)]
+        )
+        await self.bot.db.commit()
+
+        await self.bot.db.execute("PRAGMA foreign_keys = ON")
+        await migrations.migrate(self.bot.db)
+
+        self.assertEqual(
+            await migrations.get_version(self.bot.db),
+            len(migrations.MIGRATIONS),
+        )
+        self.assertEqual(
+            await self.rows(
+                """
+                SELECT event_id, event_name, is_done, guild_id
+                  FROM eventeso_event
+                 ORDER BY event_id
+                """),
+            [(1, "vAS", 1, None), (2, "vCR", 0, None)],
+        )
+        self.assertEqual(
+            await self.rows(
+                """
+                SELECT event_id, role, user_id
+                  FROM eventeso_participant
+                 ORDER BY event_id, role
+                """),
+            [(1, "dps0", 100), (1, "leader", 100), (2, "tank0", 101)],
+        )
+        self.assertEqual(await self.rows("PRAGMA foreign_key_check"), [])
+
+        # migrating again changes nothing
+        await migrations.migrate(self.bot.db)
+        self.assertEqual(
+            await migrations.get_version(self.bot.db),
+            len(migrations.MIGRATIONS),
+        )
+
+    async def test_add_stats_matches_rebuild(self):
+        # the DB as of the version before the stats
+        version = migrations.MIGRATIONS.index(migrations.add_stats)
+        await self.bot.db.execute("PRAGMA foreign_keys = OFF")
+        for func in migrations.MIGRATIONS[:version]:
+            await func(self.bot.db)
+        await self.bot.db.execute(f"PRAGMA user_version = {version:d}")
+        await self.bot.db.commit()
+        await self.bot.db.execute("PRAGMA foreign_keys = ON")
+
+        rng = random.Random(1)
+        for event_id in range(1, 200):
+            # the first half is archived
+            suffix = "_archive" if event_id < 100 else ""
+            await self.bot.db.execute(
+                f"""
+                INSERT INTO eventeso_event{suffix}
+                       (event_id, event_name, event_type, is_done,
+                        trigger_at, guild_id)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (event_id, rng.choice("ab"), rng.choice(["trial", "arena"]),
+                 rng.random() < 0.8,
+                 f"2021-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+                 " 20:00:00",
+                 rng.choice([1, 2, None]))
+            )
+            for _ in range(rng.randint(0, 6)):
+                await self.bot.db.execute(
+                    f"""
+                    INSERT OR IGNORE INTO eventeso_participant{suffix}
+                    VALUES (?, ?, ?)
+                    """,
+                    (event_id, rng.choice(["leader", "fill", "dps0", "tank0"]),
+                     rng.randint(1, 20))
+                )
+        await self.bot.db.commit()
+
+        await migrations.migrate(self.bot.db)
+        migrated = {
+            table: await self.rows(f"SELECT * FROM {table} ORDER BY 1, 2, 3")
+            for table in attendance.AGGREGATE_TABLES
+        }
+        self.assertTrue(migrated["eventeso_stats_user"])
+
+        await attendance.rebuild(self.bot.db)
+        for table in attendance.AGGREGATE_TABLES:
+            self.assertEqual(
+                await self.rows(f"SELECT * FROM {table} ORDER BY 1, 2, 3"),
+                migrated[table],
+                table,
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
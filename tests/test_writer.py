@@ -0,0 +1,94 @@
+import sqlite3
+import unittest
+
+from cogs.EventESO.writer import ParticipantWriter
+
+from .common import DBTestCase
+
+
+def insert(event_id, role, user_id):
+    return [(
+        """
+        INSERT OR IGNORE INTO eventeso_participant
+        VALUES (:event_id,
+                :role,
+                :user_id)
+        """,
+        {'event_id': event_id, 'role': role, 'user_id': user_id}
+    )]
+
+
+def delete(event_id, role, user_id):
+    return [(
+        """
+        DELETE FROM eventeso_participant
+         WHERE event_id = :event_id
+           AND role = :role
+           AND user_id = :user_id
+        """,
+        {'event_id': event_id, 'role': role, 'user_id': user_id}
+    )]
+
+
+class ParticipantWriterTest(DBTestCase):
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.writer = ParticipantWriter(self.bot)
+        self.event_id = await self.create_event()
+
+    async def test_flush_in_order(self):
+        self.writer.enqueue(insert(self.event_id, "dps0", 1))
+        self.writer.enqueue(delete(self.event_id, "dps0", 1))
+        self.writer.enqueue(insert(self.event_id, "tank0", 1))
+        await self.writer.flush()
+
+        self.assertEqual(
+            await self.participants(self.event_id), [("tank0", 1)])
+
+    async def test_failed_flush_is_requeued_in_order(self):
+        # another connection holds the write lock of the DB
+        await self.bot.db.execute("PRAGMA busy_timeout = 0")
+        other = await self.connect(isolation_level=None)
+        await other.execute("BEGIN IMMEDIATE")
+
+        execute = self.writer._execute
+
+        async def enqueue_then_execute(db, statements):
+            # queued during the flush, it must apply after the others
+            if not self.writer._pending:
+                self.writer.enqueue(delete(self.event_id, "dps0", 1))
+            return await execute(db, statements)
+
+        self.writer._execute = enqueue_then_execute
+        self.writer.enqueue(insert(self.event_id, "dps0", 1))
+        self.writer.enqueue(insert(self.event_id, "dps0", 2))
+        with self.assertRaises(sqlite3.OperationalError):
+            await self.writer.flush()
+        self.assertFalse(self.bot.db.in_transaction)
+        self.writer._execute = execute
+
+        await other.execute("ROLLBACK")
+        await self.writer.flush()
+
+        self.assertEqual(
+            await self.participants(self.event_id), [("dps0", 2)])
+        self.assertEqual(self.writer._pending, [])
+
+    async def test_refused_change_is_dropped(self):
+        self.writer.enqueue(insert(self.event_id, "dps0", 1))
+        # the event does not exist
+        self.writer.enqueue(insert(self.event_id + 1, "dps0", 2))
+        self.writer.enqueue(insert(self.event_id, "tank0", 3))
+        with self.assertLogs("cogs.EventESO.writer", "ERROR"):
+            await self.writer.flush()
+
+        self.assertEqual(
+            await self.participants(self.event_id),
+            [("dps0", 1), ("tank0", 3)],
+        )
+        self.assertEqual(self.writer._pending, [])
+
+
+if __name__ == "__main__":
+    unittest.main()